@@ -0,0 +1,95 @@
+"""Category x month totals over many years, with trends.
+
+Totals come from one grouped query of the rollups (see Repository.
+month_totals) and are laid out as a category x month matrix, so moving
+averages and year-over-year changes are computed for all categories at
+once with NumPy. NumPy is imported on first use, like the charting
+stack in charts.py.
+"""
+
+
+def month_matrix(rows, categories, first_year, last_year):
+    """Return matrix of totals, one row per category and one column per
+    month from January of 'first_year' to December of 'last_year'.
+
+    'rows' are (category, year, month, total), 'categories' the names
+    in the order of the matrix rows. Months without expenses are 0.
+    """
+
+    import numpy as np
+
+    matrix = np.zeros((len(categories), (last_year - first_year + 1) * 12))
+    if rows:
+        index = {category: i for i, category in enumerate(categories)}
+        category, year, month, total = zip(*rows)
+        matrix[
+            [index[name] for name in category],
+            (np.array(year) - first_year) * 12 + np.array(month) - 1,
+        ] = np.array(total, dtype=float)
+    return matrix
+
+
+def moving_average(matrix, window):
+    """Return mean of the last 'window' months for every month of every
+    row. The first 'window' - 1 months are NaN."""
+
+    import numpy as np
+
+    sums = np.cumsum(matrix, axis=1)
+    averages = np.full(matrix.shape, np.nan)
+    averages[:, window - 1:] = sums[:, window - 1:]
+    averages[:, window:] -= sums[:, :-window]
+    averages[:, window - 1:] /= window
+    return averages
+
+
+def year_over_year(matrix):
+    """Return change against the same month of the previous year, in
+    money and in percent. Months of the first year are NaN, as are
+    percentages against months without expenses."""
+
+    import numpy as np
+
+    change = np.full(matrix.shape, np.nan)
+    percent = np.full(matrix.shape, np.nan)
+    change[:, 12:] = matrix[:, 12:] - matrix[:, :-12]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent[:, 12:] = np.where(
+            matrix[:, :-12] != 0, change[:, 12:] / matrix[:, :-12] * 100, np.nan
+        )
+    return change, percent
+
+
+def _by_category(categories, matrix):
+    """Return dict of lists of values rounded to cents (None for NaN)."""
+
+    import numpy as np
+
+    values = np.round(matrix, 2).astype(object)
+    values[np.isnan(matrix)] = None
+    return dict(zip(categories, values.tolist()))
+
+
+def analyze(rows, first_year, last_year, window=3):
+    """Return dict with months, totals, moving averages and year-over-year
+    changes per category, ready to be sent as JSON."""
+
+    categories = sorted({row[0] for row in rows})
+    matrix = month_matrix(rows, categories, first_year, last_year)
+    change, percent = year_over_year(matrix)
+    return {
+        'from': first_year,
+        'to': last_year,
+        'window': window,
+        'months': [
+            f'{year}-{month:02d}'
+            for year in range(first_year, last_year + 1)
+            for month in range(1, 13)
+        ],
+        'totals': _by_category(categories, matrix),
+        'moving_average': _by_category(
+            categories, moving_average(matrix, window)
+        ),
+        'yoy_change': _by_category(categories, change),
+        'yoy_change_percent': _by_category(categories, percent),
+    }
@@ -1,17 +1,39 @@
 import datetime
-import mpld3
+import io
+import itertools
+import math
 import re
-import seaborn as sns
 
+from analytics import analyze
+from charts import (
+    ChartQueueFull, ChartUnavailable, get_pie, invalidate_charts, preload_charts
+)
 from config import Config
-from flask import Flask, redirect, render_template, request, session
+from flask import (
+    Flask, Response, g, jsonify, redirect, render_template, request, session,
+    stream_with_context
+)
 from flask_session import Session
 from flask_sqlalchemy import SQLAlchemy
-from matplotlib.figure import Figure
-from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+from werkzeug.http import is_resource_modified
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from helpers import get_values, login_required, sorry, usd, months
+from helpers import (
+    api_error, api_login_required, get_view, login_required, month_calendar,
+    sorry, usd, months
+)
+from database import (
+    SQLITE_WRITER_POOL, set_statement_timeout, sqlite_production, watch_pool
+)
+from exporter import FORMATS, to_csv, to_ndjson
+from importer import read_csv, read_ofx
+from instrumentation import chart_timer, instrument_app
+from metrics import exposition
+from repository import Repository
+from rollups import MAX_EXPENSE
+from sessions import make_session_interface
+from versions import page_etag, page_responses, templates_digest
 
 # Configure application
 app = Flask(__name__)
@@ -28,183 +50,458 @@ app.jinja_env.filters['usd'] = usd
 # for server-side sessions to your application.
 # https://stackoverflow.com/questions/32084646/flask-session-extension-vs-default-session
 app.config['SESSION_PERMANENT'] = False
-app.config['SESSION_TYPE'] = 'filesystem'
-Session(app)
-
-# Configure database connection
+if app.config['SESSION_BACKEND'] == 'filesystem':
+    app.config['SESSION_TYPE'] = 'filesystem'
+    Session(app)
+else:
+    # Sessions shared by workers (SQLite) or hosts (Redis)
+    app.session_interface = make_session_interface(app.config)
+
+# Configure database connection. In SQLite production mode this engine
+# is the single writer, reads get a pool of read-only connections.
+sqlite_production_mode = (
+    app.config['SQLITE_PRODUCTION']
+    and app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite')
+)
+if sqlite_production_mode:
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = dict(
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'], **SQLITE_WRITER_POOL
+    )
 db = SQLAlchemy(app)
 
+# Queries shared with the cs50 variant. The engine (and its pool, see
+# SQLALCHEMY_ENGINE_OPTIONS) is created once here and used outside of
+# the application context by every request.
+with app.app_context():
+    if sqlite_production_mode:
+        repository = Repository(db.engine, sqlite_production(
+            db.engine,
+            Config.SQLALCHEMY_ENGINE_OPTIONS,
+            app.config['SQLITE_CACHE_MB'],
+            app.config['SQLITE_MMAP_MB'],
+            app.config['SQLITE_BUSY_TIMEOUT'],
+        ))
+    else:
+        repository = Repository(db.engine)
+engines = {'main': repository.engine}
+if repository.read_engine is not repository.engine:
+    engines['reader'] = repository.read_engine
 
-@app.route('/')
-@login_required
-def index():
-    """Show current month view of expenses."""
+# Report the pools at '/metrics' and limit the time of statements
+for name, engine in engines.items():
+    watch_pool(engine, name)
+    set_statement_timeout(engine, app.config['DB_STATEMENT_TIMEOUT'])
+
+# Measure time spent per route in the database, templates and charts
+instrument_app(
+    app, engines.values(), app.config['SLOW_REQUEST_SECONDS']
+)
+
+# Load the charting stack up front only if requested
+if app.config['CHART_PRELOAD']:
+    preload_charts()
+
+
+# Pages change with the templates and the chart renderer too
+ETAG_SALT = (
+    templates_digest(f'{app.root_path}/{app.template_folder}'),
+    app.config['CHART_RENDERER'],
+)
+
+# Largest page of the JSON API
+API_MAX_LIMIT = 1000
+
+# Longest range of years of '/analytics'
+ANALYTICS_MAX_YEARS = 20
+
+
+def api_response(payload):
+    """Return JSON response with an ETag, or 304 if the client has it."""
+
+    response = jsonify(payload)
+    response.add_etag()
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def not_modified(*parts):
+    """Return 304 response if the client has the current page, else None.
+
+    The page is identified by the data version of the user and 'parts'
+    (e.g. the year shown). Its ETag and Last-Modified are added to the
+    response by set_validators().
+    """
+
+    version, modified = repository.data_version(session['user_id'])
+    return revalidate(version, modified, *parts)
 
-    # Get list of years of expenses from database and remember them
-    # to share across all templates
-    with app.app_context():
-        session['years'] = get_values(
-            db, 'expenses', 'year', session['user_id'], distinct=True
+
+def revalidate(version, modified, *parts):
+    """Return 304 response if the client has the page of this data
+    version, else None (see not_modified())."""
+
+    g.etag = page_etag(ETAG_SALT, session['user_id'], version, *parts)
+    # Cached lists shown on the page must be of the same version
+    g.data_version = version
+    g.last_modified = modified
+
+    if is_resource_modified(
+        request.environ, etag=g.etag, last_modified=modified
+    ):
+        return None
+    return Response(status=304)
+
+
+@app.after_request
+def set_validators(response):
+    """Add validators of pages checked by not_modified() to the response."""
+
+    if 'etag' in g and response.status_code in (200, 304):
+        response.set_etag(g.etag)
+        response.last_modified = g.last_modified
+        # Browsers revalidate the page every time it is shown
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        page_responses.inc(
+            route=request.endpoint, status=str(response.status_code)
         )
+    return response
 
-    # Determine the year for which expenses will be displayed
-    if request.args.get('disp_year'):
-        session['year'] = request.args.get('disp_year')
-    elif session.get('year', None) is None:
-        session['year'] = datetime.date.today().year
 
-    # Determine the month for which expenses will be displayed
-    # Based on user request or defaulting to current month
+# Parts of the dashboard pages shared with asgi.py, which runs the
+# same pages with an async engine
+
+def month_view():
+    """Return year and month asked for on '/' (by default those of the
+    previous view) and remember them in the session.
+
+    Raise ValueError with the message for the user if they are not valid.
+    """
+
+    year, month_no = get_view()
+    if request.args.get('disp_year'):
+        try:
+            year = int(request.args.get('disp_year'))
+        except ValueError:
+            raise ValueError('Must provide correct year.')
     if request.args.get('months_radio'):
-        session[session['year']] = (
-            months.index(request.args.get('months_radio')) + 1
-        )
-    elif session.get(session['year'], None) is None:
-        session[session['year']] = datetime.date.today().month
+        try:
+            month_no = months.index(request.args.get('months_radio')) + 1
+        except ValueError:
+            raise ValueError('Must provide correct month.')
 
-    # Query database to get categories of the logged-in user
-    cat_list = get_values(db, 'categories', 'category', session['user_id'])
+    # Remember the view (the session is written only if it changed)
+    view = {'year': year, 'month': month_no}
+    if session.get('view') != view:
+        session['view'] = view
+    return year, month_no
 
-    # Query database to find the sum of expenses per category and day
-    # for the selected month
-    month_expenses = {}
-    total_expenses = {}
-    for category in cat_list:
-        with app.app_context():
-            expenses = db.session.execute(
-                text(
-                    """
-                    SELECT expenses.id AS expense_id, year, month, day,
-                           SUM(expense) AS expense
-                      FROM expenses, categories
-                     WHERE expenses.category_id = categories.id
-                       AND expenses.user_id = categories.user_id
-                       AND expenses.user_id = :user_id
-                       AND category = :category
-                       AND month = :month_no
-                       AND year = :year
-                     GROUP BY year, month, day
-                    """
-                ),
-                {
-                    'user_id': session['user_id'],
-                    'category': category,
-                    'month_no': session[session['year']],
-                    'year': session['year'],
-                }
-            ).fetchall()
-
-        # Add sorted list of tuples with all expenses per day
-        # to the dictionary with categories
-        month_expenses[category] = expenses
-
-        # Query database to calculate total expenses per category
-        # for the selected month
-        with app.app_context():
-            total = db.session.execute(
-                text(
-                    """
-                    SELECT SUM(expense) AS sum
-                      FROM expenses, categories
-                     WHERE expenses.category_id = categories.id
-                       AND expenses.user_id = categories.user_id
-                       AND expenses.user_id = :user_id
-                       AND category = :category
-                       AND month = :month_no
-                       AND year = :year
-                    """
-                ),
-                {
-                    'user_id': session['user_id'],
-                    'category': category,
-                    'month_no': session[session['year']],
-                    'year': session['year'],
-                }
-            ).fetchone()
-
-        # Add total sum of expenses to the dict by a category
-        # (only one tuple of sums in 'total')
-        total_expenses[category] = total[0]
 
-    # Render the template with retrieved data
+def index_page(year, month_no, cat_list, month_expenses, total_expenses):
+    """Return month view of expenses (see Repository.month_grid)."""
+
     return render_template(
         'index.html',
         months=months,
-        month_no=session[session['year']],
-        year=session['year'],
-        years=session['years'],
+        month_no=month_no,
+        month_calendar=month_calendar(year, month_no),
+        year=year,
         month_expenses=month_expenses,
         total_expenses=total_expenses,
         cat_list=cat_list,
     )
 
 
+def pie_view():
+    """Return year of the pie chart and whether the browser is a mobile
+    one."""
+
+    year, _ = get_view()
+
+    # Check if user is using a mobile browser
+    browser = request.user_agent
+    browser = re.search('Mobile', str(browser))
+    return year, browser != None
+
+
+def pie_page(year, mobile, plot_data=None):
+    """Return page with the pie chart of the sums of expenses per category
+    ('plot_data'), drawn by the browser if CHART_RENDERER is 'client'."""
+
+    # Let the browser draw the chart from '/structure/data'
+    if app.config['CHART_RENDERER'] == 'client':
+        return render_template(
+            'pie_chart.html',
+            chart_url='/structure/data',
+            year=year,
+        )
+
+    # Render the chart (or take it from the cache) to embed it into template
+    try:
+        with chart_timer():
+            mpld3_plot = get_pie(session['user_id'], year, plot_data, mobile)
+    except ChartQueueFull:
+        return sorry('Too many charts are being drawn. Try again later.', 503)
+    except ChartUnavailable:
+        return sorry('Drawing the chart took too long. Try again later.', 504)
+
+    response = app.make_response(render_template(
+        'pie_chart.html',
+        mpld3_plot=mpld3_plot,
+        year=year,
+    ))
+    # The chart is drawn for mobile or desktop browsers
+    response.vary.add('User-Agent')
+    return response
+
+
+def categories_page(cat_list):
+    """Return list of expense categories."""
+
+    return render_template(
+        'categories.html',
+        cat_list=cat_list,
+    )
+
+
+@app.context_processor
+def inject_years():
+    """Share list of years of expenses with all templates."""
+
+    if session.get('user_id') is None:
+        return {}
+    return {'years': repository.expense_years(
+        session['user_id'], g.get('data_version')
+    )}
+
+
+@app.route('/')
+@login_required
+def index():
+    """Show current month view of expenses."""
+
+    # Determine the year and month for which expenses will be displayed
+    # Based on user request or the previous view (current month by default)
+    try:
+        year, month_no = month_view()
+    except ValueError as error:
+        return sorry(str(error))
+
+    # Nothing to do if the user's data didn't change since the last view
+    response = not_modified('index', year, month_no)
+    if response is not None:
+        return response
+
+    # Query database to get categories of the logged-in user
+    cat_list = repository.category_names(session['user_id'], g.data_version)
+
+    # Query database to find the sum of expenses per category and day
+    # for the selected month, together with totals per category
+    month_expenses, total_expenses = repository.month_grid(
+        session['user_id'],
+        year,
+        month_no,
+        cat_list,
+    )
+
+    # Render the template with retrieved data
+    return index_page(year, month_no, cat_list, month_expenses, total_expenses)
+
+
 @app.route('/add', methods=['GET', 'POST'])
 @login_required
 def add_expense():
-    """Add new expense to the database."""
+    """Add new expenses to the database.
+
+    The form may hold many rows (e.g. a week of receipts), they are
+    validated together and inserted in one transaction.
+    """
 
     # User reached route via POST (as by submitting a form via POST)
     if request.method == 'POST':
-        # Retrive year, month, day if 'date' field is filled in
-        try:
-            year, month_no, day = request.form.get('date').split('-')
-        except ValueError:
-            # Error handling for invalid date format
+        # Query database to get ids of categories of the logged-in user
+        category_ids = {
+            str(category_id)
+            for category_id, _ in repository.categories(session['user_id'])
+        }
+
+        # A row with a field missing fails validation below
+        rows = itertools.zip_longest(
+            request.form.getlist('date'),
+            request.form.getlist('category_id'),
+            request.form.getlist('expense'),
+            fillvalue='',
+        )
+        expenses = []
+        for row_no, (date, category_id, expense) in enumerate(rows, start=1):
+            # Skip rows left empty
+            if not date and category_id in ('', '0') and not expense:
+                continue
+
+            # Retrive year, month, day if 'date' field is filled in
+            try:
+                year, month_no, day = [
+                    int(part) for part in date.split('-')
+                ]
+                datetime.date(year, month_no, day)
+            except ValueError:
+                # Error handling for invalid date format
+                return sorry(f'Must provide date (row {row_no}).')
+
+            # Check if user selected category in 'category' field
+            if category_id not in category_ids:
+                return sorry(f'Must provide category (row {row_no}).')
+
+            # Check if the 'expense' field is empty or not a positive number
+            # (small enough for the rollup totals)
+            try:
+                amount = float(expense)
+            except ValueError:
+                return sorry(f'Must provide amount (row {row_no}).')
+            if not math.isfinite(amount) or not 0 < amount <= MAX_EXPENSE:
+                return sorry(f'Must provide amount (row {row_no}).')
+
+            expenses.append({
+                'user_id': session['user_id'],
+                'year': year,
+                'month': month_no,
+                'day': day,
+                'category_id': int(category_id),
+                'expense': amount,
+            })
+
+        if not expenses:
             return sorry('Must provide date.')
 
-        # Check if user selected category in 'category' field
-        if request.form.get('category_id') == '0':
-            return sorry('Must provide category.')
-
-        # Check if the 'expense' field is empty
-        if not request.form.get('expense'):
-            return sorry('Must provide amount.')
-
-        # Insert the new expense into the 'expenses' table
-        with app.app_context():
-            db.session.execute(
-                text(
-                    """
-                    INSERT INTO expenses (user_id, year, month, day, category_id, expense)
-                    VALUES (:user_id, :year, :month, :day, :category_id, :expense)
-                    """
-                ),
-                {
-                    'user_id': session['user_id'],
-                    'year': year,
-                    'month': month_no,
-                    'day': day,
-                    'category_id': request.form.get('category_id'),
-                    'expense': request.form.get('expense'),
-                }
-            )
-            db.session.commit()
+        # Insert all new expenses into the 'expenses' table at once
+        repository.add_expenses(session['user_id'], expenses)
+        for year in {expense['year'] for expense in expenses}:
+            invalidate_charts(session['user_id'], year)
         return redirect('/')
 
     # User reached route via GET
     else:
         # Query database to get id and categories of the logged-in user
-        with app.app_context():
-            cat_list = db.session.execute(
-                text(
-                    """
-                    SELECT id, category
-                      FROM categories
-                     WHERE user_id = :user_id
-                     ORDER BY category
-                    """
-                ),
-                {'user_id': session['user_id']}
-            ).fetchall()
+        cat_list = repository.categories(session['user_id'])
 
         return render_template(
             'add_expense.html',
             cat_list=cat_list,
-            years=session['years'],
         )
 
 
+@app.route('/analytics')
+@login_required
+def analytics():
+    """Return totals per category and month of a range of years as JSON,
+    with moving averages and year-over-year changes."""
+
+    year, _ = get_view()
+    try:
+        last_year = int(request.args.get('to', year))
+        first_year = int(request.args.get('from', last_year - 4))
+        window = int(request.args.get('window', 3))
+    except ValueError:
+        return api_error('Must provide correct years and window.')
+    if not 0 <= last_year - first_year < ANALYTICS_MAX_YEARS:
+        return api_error(
+            f'Must provide a range of 1 to {ANALYTICS_MAX_YEARS} years.'
+        )
+    if not 1 <= window <= 12:
+        return api_error('Window must be 1 to 12 months.')
+
+    # Nothing to do if the user's data didn't change since the last view
+    response = not_modified('analytics', first_year, last_year, window)
+    if response is not None:
+        return response
+
+    # All the totals come from one grouped query of the rollups
+    rows = repository.month_totals(session['user_id'], first_year, last_year)
+
+    return jsonify(analyze(rows, first_year, last_year, window))
+
+
+@app.route('/api/v1/categories')
+@api_login_required
+def api_categories():
+    """Return categories of the user."""
+
+    rows = repository.categories(session['user_id'])
+
+    return api_response(
+        {'categories': [{'id': row.id, 'name': row.category} for row in rows]}
+    )
+
+
+@app.route('/api/v1/expenses')
+@api_login_required
+def api_expenses():
+    """Return a page of expenses of the user, ordered by id.
+
+    Pages are chained with 'after_id' (keyset pagination): pass the
+    'next_after_id' of a page to get the next one. Optional 'year' and
+    'month' narrow the expenses down.
+    """
+
+    try:
+        after_id = int(request.args.get('after_id', 0))
+        limit = min(int(request.args.get('limit', 100)), API_MAX_LIMIT)
+    except ValueError:
+        return api_error('Must provide integer after_id and limit.')
+    if limit < 1:
+        return api_error('Must provide positive limit.')
+    try:
+        year = request.args.get('year')
+        year = int(year) if year is not None else None
+        month_no = request.args.get('month')
+        month_no = int(month_no) if month_no is not None else None
+    except ValueError:
+        return api_error('Must provide correct year and month.')
+    if month_no is not None and not 1 <= month_no <= 12:
+        return api_error('Must provide correct month.')
+
+    page, next_after_id = repository.expenses_page(
+        session['user_id'], after_id, limit, year, month_no
+    )
+    return api_response({
+        'expenses': [
+            {
+                'id': row.id,
+                'date': f'{row.year:04d}-{row.month:02d}-{row.day:02d}',
+                'category_id': row.category_id,
+                'amount': float(row.expense),
+            }
+            for row in page
+        ],
+        'next_after_id': next_after_id,
+    })
+
+
+@app.route('/api/v1/summary')
+@api_login_required
+def api_summary():
+    """Return sums of expenses per category in a year or a month."""
+
+    year, _ = get_view()
+    try:
+        year = int(request.args.get('year', year))
+        month_no = request.args.get('month')
+        month_no = int(month_no) if month_no is not None else None
+    except ValueError:
+        return api_error('Must provide correct year and month.')
+    if month_no is not None and not 1 <= month_no <= 12:
+        return api_error('Must provide correct month.')
+
+    sums = repository.category_sums(session['user_id'], year, month_no)
+
+    return api_response({
+        'year': year,
+        'month': month_no,
+        'totals': {category: float(total) for category, total in sums.items()},
+    })
+
+
 @app.route('/categories', methods=['GET', 'POST'])
 @login_required
 def categories():
@@ -218,10 +515,7 @@ def categories():
             return sorry('Must provide category name.')
 
         # Query database to get categories of the logged-in user
-        with app.app_context():
-            cat_list = get_values(
-                db, 'categories', 'category', session['user_id']
-            )
+        cat_list = repository.category_names(session['user_id'])
 
         # Change categories' names to lowercase
         cat_list = [category.lower() for category in cat_list]
@@ -230,21 +524,15 @@ def categories():
         if request.form.get('category_name').lower() in cat_list:
             return sorry('Category name already exists.')
 
-        # Insert the new category into the 'categories' table
-        with app.app_context():
-            db.session.execute(
-                text(
-                    """
-                    INSERT INTO categories (category, user_id)
-                    VALUES(:category, :user_id)
-                    """
-                ),
-                {
-                    'category': request.form.get('category_name').title(),
-                    'user_id': session['user_id'],
-                }
+        # Insert the new category into the 'categories' table (the unique
+        # index rejects a category added in the meantime, which the
+        # cached list may not show yet)
+        try:
+            repository.add_category(
+                session['user_id'], request.form.get('category_name').title()
             )
-            db.session.commit()
+        except IntegrityError:
+            return sorry('Category name already exists.')
 
         # Redirect user to category list
         return redirect('/categories')
@@ -252,15 +540,8 @@ def categories():
     # User reached route via GET
     else:
         # Query database to get categories of the logged-in user
-        with app.app_context():
-            cat_list = get_values(
-                db, 'categories', 'category', session['user_id']
-            )
-        return render_template(
-            'categories.html',
-            years=session['years'],
-            cat_list=cat_list,
-        )
+        cat_list = repository.category_names(session['user_id'])
+        return categories_page(cat_list)
 
 
 @app.route('/delete/category', methods=['GET', 'POST'])
@@ -270,44 +551,11 @@ def delete_category():
 
     # User reached route via POST (as by submitting a form via POST)
     if request.method == 'POST':
-        # Query database to check if there are any expenses in category
-        with app.app_context():
-            expenses_in_category = db.session.execute(
-                text(
-                    """
-                    SELECT id, category_id
-                      FROM expenses
-                     WHERE user_id = :user_id
-                       AND category_id IN
-                           (SELECT id
-                              FROM categories
-                             WHERE user_id = :user_id
-                               AND category = :category)
-                    """
-                ),
-                {
-                    'user_id': session['user_id'],
-                    'category': request.form.get('del_category'),
-                }
-            ).fetchall()
-
-        # If the category is empty, can be deleted
-        if not expenses_in_category:
-            with app.app_context():
-                db.session.execute(
-                    text(
-                        """
-                        DELETE FROM categories
-                         WHERE category = :category
-                           AND user_id = :user_id
-                        """
-                    ),
-                    {
-                        'category': request.form.get('del_category'),
-                        'user_id': session['user_id'],
-                    }
-                )
-                db.session.commit()
+        # The category can be deleted only if it is empty
+        if repository.delete_category(
+            session['user_id'], request.form.get('del_category')
+        ):
+            invalidate_charts(session['user_id'])
             # Show all categories
             return redirect('/categories')
 
@@ -331,57 +579,25 @@ def delete_expense():
     if request.method == 'POST':
         # Request to remove the chosen expense in 'delete_expense.html'
         if request.form.get('del_chosen_expense'):
-            with app.app_context():
-                db.session.execute(
-                    text("DELETE FROM expenses WHERE id = :expense_id"),
-                    {'expense_id': request.form.get('del_chosen_expense')}
-                )
-                db.session.commit()
+            expense = repository.delete_expense(
+                session['user_id'],
+                request.form.get('del_chosen_expense'),
+            )
+            if expense is not None:
+                invalidate_charts(session['user_id'], expense.year)
             # Redirect user to home page
             return redirect('/')
 
         # Request to remove the expense
         if request.form.get('del_expense'):
-            # Query database to find the expense info
-            with app.app_context():
-                expense_category_day = db.session.execute(
-                    text(
-                        """
-                        SELECT year, month, day, category_id, category
-                          FROM expenses
-                          JOIN categories
-                            ON expenses.category_id = categories.id
-                         WHERE expenses.user_id = :user_id
-                           AND expenses.id = :expense_id
-                        """
-                    ),
-                    {
-                        'user_id': session['user_id'],
-                        'expense_id': request.form.get('del_expense'),
-                    }
-                ).fetchall()
-
-            # Count all expenses on this day
-            with app.app_context():
-                expenses_list = db.session.execute(
-                    text(
-                        """
-                        SELECT id, expense FROM expenses
-                         WHERE user_id = :user_id
-                           AND year = :year
-                           AND month = :month
-                           AND day = :day
-                           AND category_id = :category_id
-                        """
-                    ),
-                    {
-                        'user_id': session['user_id'],
-                        'year': expense_category_day[0][0],
-                        'month': expense_category_day[0][1],
-                        'day': expense_category_day[0][2],
-                        'category_id': expense_category_day[0][3],
-                    }
-                ).fetchall()
+            # Query database to find the expense info and all expenses
+            # on this day
+            expense, expenses_list = repository.expense_day(
+                session['user_id'],
+                request.form.get('del_expense'),
+            )
+            if expense is None:
+                return redirect('/')
 
             # If there is more than one expense, redirect user to choose
             # which to delete
@@ -389,18 +605,17 @@ def delete_expense():
                 return render_template(
                     'delete_expense.html',
                     expenses_list=expenses_list,
-                    expense_category_day=expense_category_day,
-                    years=session['years'],
+                    expense_category_day=[expense],
                 )
 
             # If only one expense, delete it
             else:
-                with app.app_context():
-                    db.session.execute(
-                        text("DELETE FROM expenses WHERE id = :expense_id"),
-                        {'expense_id': request.form.get('del_expense')}
-                    )
-                    db.session.commit()
+                expense = repository.delete_expense(
+                    session['user_id'],
+                    request.form.get('del_expense'),
+                )
+                if expense is not None:
+                    invalidate_charts(session['user_id'], expense.year)
                 # Redirect user to home page
                 return redirect('/')
 
@@ -409,6 +624,85 @@ def delete_expense():
         return redirect('/')
 
 
+@app.route('/export')
+@login_required
+def export():
+    """Stream expenses in a date range as CSV or NDJSON file."""
+
+    # Check requested format
+    file_format = request.args.get('format', 'csv')
+    if file_format not in FORMATS:
+        return sorry('Must provide correct format.')
+
+    # Dates are optional, the whole history is exported by default
+    try:
+        start, end = [
+            datetime.date.fromisoformat(request.args.get(name))
+            if request.args.get(name) else None
+            for name in ('start', 'end')
+        ]
+    except ValueError:
+        return sorry('Must provide correct dates.')
+
+    rows = repository.export_expenses(
+        session['user_id'],
+        start,
+        end,
+        request.args.getlist('category'),
+    )
+    if file_format == 'csv':
+        lines = to_csv(rows)
+    else:
+        lines = to_ndjson(rows)
+
+    # Send the file while rows are fetched
+    return Response(
+        stream_with_context(lines),
+        mimetype=FORMATS[file_format],
+        headers={
+            'Content-Disposition':
+                f'attachment; filename=expenses.{file_format}',
+        },
+    )
+
+
+@app.route('/import', methods=['GET', 'POST'])
+@login_required
+def import_file():
+    """Import expenses from a CSV or OFX file."""
+
+    cat_list = repository.category_names(session['user_id'])
+
+    # User reached route via POST (as by submitting a form via POST)
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if upload is None or not upload.filename:
+            return sorry('Must provide file.')
+
+        # Read the uploaded file as a text stream (lines which aren't UTF-8
+        # are rejected by the import)
+        stream = io.TextIOWrapper(
+            upload.stream, encoding='utf-8-sig', errors='replace', newline=''
+        )
+        if upload.filename.lower().endswith(('.ofx', '.qfx')):
+            if not request.form.get('category'):
+                return sorry('Must provide category of OFX transactions.')
+            rows = read_ofx(stream, request.form.get('category'))
+        else:
+            rows = read_csv(stream)
+
+        # Insert expenses in chunks, one transaction per chunk. Errors of
+        # the file are reported with the count of rows imported before.
+        result = repository.import_expenses(session['user_id'], rows)
+        invalidate_charts(session['user_id'])
+
+        return render_template('import.html', cat_list=cat_list, result=result)
+
+    # User reached route via GET
+    else:
+        return render_template('import.html', cat_list=cat_list)
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     """Log user in."""
@@ -427,20 +721,16 @@ def login():
             return sorry('Must provide password.')
 
         # Query the database to get a username
-        with app.app_context():
-            user = db.session.execute(
-                text("SELECT * FROM users WHERE username = :username"),
-                {'username': request.form.get('username')}
-            ).fetchone()
+        user = repository.find_user(request.form.get('username'))
 
         # Check if the entered username already exists
         if (user is None or
-            not check_password_hash(user[2], request.form.get('password'))):
+            not check_password_hash(user.hash, request.form.get('password'))):
             # Return error message
             return sorry('Invalid username or password.')
 
         # Remember which user logged in
-        session['user_id'] = user[0]
+        session['user_id'] = user.id
 
         # Redirect user to home page
         return redirect('/')
@@ -461,6 +751,13 @@ def logout():
     return redirect('/')
 
 
+@app.route('/metrics')
+def metrics():
+    """Show metrics of this process in the Prometheus text format."""
+
+    return Response(exposition(), mimetype='text/plain; version=0.0.4')
+
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     """Register user."""
@@ -471,16 +768,9 @@ def register():
         if not request.form.get('username'):
             return sorry('Must provide username.')
 
-        # Query the database to get a list of existing usernames
-        with app.app_context():
-            usernames = db.session.execute(
-                text("SELECT username FROM users")
-            ).fetchall()
-
         # Check if the entered username already exists in the database
-        for user in usernames:
-            if request.form.get('username') == user[0]:
-                return sorry('Username already exists.')
+        if repository.username_exists(request.form.get('username')):
+            return sorry('Username already exists.')
 
         # Check if the 'password' field is empty
         if not request.form.get('password'):
@@ -494,20 +784,11 @@ def register():
         hashed_password = generate_password_hash(request.form.get('password'))
 
         # Insert the username and hashed password into the 'users' table
-        with app.app_context():
-            db.session.execute(
-                text(
-                    """
-                    INSERT INTO users (username, hash)
-                    VALUES(:username, :hash)
-                    """
-                ),
-                {
-                    'username': request.form.get('username'),
-                    'hash': hashed_password,
-                }
-            )
-            db.session.commit()
+        # (the unique index rejects a username registered in the meantime)
+        try:
+            repository.create_user(request.form.get('username'), hashed_password)
+        except IntegrityError:
+            return sorry('Username already exists.')
 
         # Redirect user to the homepage after successful registration
         return redirect('/')
@@ -525,10 +806,7 @@ def rename_category():
 
     # User reached route via POST (as by submitting a form via POST)
     if request.method == 'POST':
-        with app.app_context():
-            cat_list = get_values(
-                db, 'categories', 'category', session['user_id']
-            )
+        cat_list = repository.category_names(session['user_id'])
 
         # Check if the 'old_name' field is empty or wrong
         if (not request.form.get('old_name') or
@@ -542,22 +820,17 @@ def rename_category():
             # Return error message
             return sorry('Must provide correct new category name.')
 
-        # Update the category name
-        with app.app_context():
-            db.session.execute(
-                text(
-                    """
-                    UPDATE categories
-                       SET category = :new_category
-                     WHERE category = :old_category
-                """
-                ),
-                {
-                    'new_category': request.form.get('new_name').title(),
-                    'old_category': request.form.get('old_name').title(),
-                }
+        # Update the category name (the unique index rejects a name
+        # taken in the meantime)
+        try:
+            repository.rename_category(
+                session['user_id'],
+                request.form.get('old_name').title(),
+                request.form.get('new_name').title(),
             )
-            db.session.commit()
+        except IntegrityError:
+            return sorry('Must provide correct new category name.')
+        invalidate_charts(session['user_id'])
 
         # Show all categories
         return redirect('/categories')
@@ -572,79 +845,35 @@ def rename_category():
 def structure():
     """Generate pie chart."""
 
-    # Query database to get categories of the logged-in user
-    with app.app_context():
-        cat_list = get_values(db, 'categories', 'category', session['user_id'])
+    year, mobile = pie_view()
+
+    # Nothing to do if the user's data didn't change since the last view
+    response = not_modified('structure', year, mobile)
+    if response is not None:
+        return response
 
     # Query database to find the sum of expenses per each category
-    plot_data = {}
-    total = 0
-    for category in cat_list:
-        with app.app_context():
-            sums = db.session.execute(
-                text(
-                    """
-                    SELECT SUM(expense) AS sum
-                      FROM expenses, categories
-                     WHERE expenses.category_id = categories.id
-                       AND expenses.user_id = categories.user_id
-                       AND expenses.user_id = :user_id
-                       AND year = :year
-                       AND category = :category
-                """
-                ),
-                {
-                    'user_id': session['user_id'],
-                    'year': session['year'],
-                    'category': category,
-                }
-            ).fetchone()
-
-        # Add sum of expenses to the dictionary by a category
-        # (only one tuple of sums in sums)
-        if sums[0]:
-            plot_data[category] = sums[0]
-            total += sums[0]
+    # (the browser queries '/structure/data' itself)
+    plot_data = None
+    if app.config['CHART_RENDERER'] != 'client':
+        plot_data = repository.category_sums(session['user_id'], year)
 
-    # Check if user is using a mobile browser
-    browser = request.user_agent
-    browser = re.search('Mobile', str(browser))
-    if browser != None:
-        figsize = (4.6, 4.6)
-        textprops = {'fontsize': 12, 'horizontalalignment': 'center'}
-    else:
-        figsize = (10, 10)
-        textprops = {'fontsize': 16, 'horizontalalignment': 'center'}
-
-    # When using Matplotlib in a web server it is strongly recommended
-    # to not use pyplot
-    # https://matplotlib.org/stable/gallery/user_interfaces/web_application_server_sgskip.html
-    fig = Figure(figsize=figsize, dpi=72, layout='constrained')
-    ax = fig.subplots()
-
-    # Draw a pie chart
-    _, labels, percentages = ax.pie(
-        plot_data.values(),
-        colors=sns.color_palette('crest'),
-        labels=plot_data.keys(),
-        autopct='%.2f%%',
-        pctdistance=0.6,
-        labeldistance=0.6,
-        wedgeprops={'linewidth': 2.0, 'edgecolor': 'white'},
-        textprops=textprops,
-    )
+    return pie_page(year, mobile, plot_data)
 
-    # Adjust labels' position
-    for label, percentage in zip(labels, percentages):
-        label.set_y(label.get_position()[1] + 0.1)
-        percentage.set_y(percentage.get_position()[1] - 0.05)
 
-    # Embed the chart into html template
-    mpld3_plot = mpld3.fig_to_html(fig)
+@app.route('/structure/data')
+@login_required
+def structure_data():
+    """Return sums of expenses per category as JSON for the pie chart."""
 
-    return render_template(
-        'pie_chart.html',
-        mpld3_plot=mpld3_plot,
-        years=session['years'],
-        year=session['year'],
+    year, _ = get_view()
+
+    response = not_modified('structure_data', year)
+    if response is not None:
+        return response
+
+    plot_data = repository.category_sums(session['user_id'], year)
+
+    return jsonify(
+        {category: float(total) for category, total in plot_data.items()}
     )
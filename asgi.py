@@ -0,0 +1,299 @@
+"""ASGI entry point, with the dashboard pages on an async database engine.
+
+Usage:
+    uvicorn asgi:application
+
+'/', '/structure' and the list of categories (GET '/categories') are
+served by coroutines which query the database through an async
+SQLAlchemy engine, so one process serves many concurrent dashboard
+loads while their queries wait for the database. Every other request
+(forms, JSON API, export...) goes to the WSGI application of app.py,
+each in its own thread. Sessions, templates, ETags, caches and metrics
+are those of app.py, and so are the pages apart from their queries
+(see app.month_view() and the functions below it). Sessions are loaded
+and saved in threads, not to block the event loop.
+
+Requires asgiref, an ASGI server (e.g. uvicorn) and the async driver
+of the database: aiomysql for MySQL, aiosqlite for SQLite.
+"""
+
+import asyncio
+import inspect
+import io
+import sys
+
+from flask import g, request_started, session
+from flask.ctx import RequestContext
+from sqlalchemy.engine import make_url
+
+try:
+    from asgiref.sync import ThreadSensitiveContext
+    from asgiref.wsgi import WsgiToAsgi
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:
+    raise RuntimeError(
+        'The ASGI entry point requires the asgiref and greenlet packages'
+    )
+
+from app import (
+    app, categories_page, index_page, month_view, pie_page, pie_view,
+    revalidate, sqlite_production_mode, repository as sync_repository
+)
+from config import Config
+from database import set_statement_timeout, sqlite_reader, watch_pool
+from helpers import login_required, sorry
+from instrumentation import instrument_engine
+from repository import AsyncRepository
+
+# Async driver of every dialect
+ASYNC_DRIVERS = {
+    'mysql': 'mysql+aiomysql',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_url(url):
+    """Return url of the database with the async driver of its dialect."""
+
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+# Same database (and pool settings) as the engine of app.py
+engine = create_async_engine(
+    app.config['ASYNC_DATABASE_URL'] or async_url(sync_repository.engine.url),
+    **Config.SQLALCHEMY_ENGINE_OPTIONS,
+)
+repository = AsyncRepository(engine)
+
+# Statements and the pool are reported like the ones of app.py. The
+# SQLite statement timeout needs the connection of the sync driver.
+instrument_engine(engine.sync_engine)
+watch_pool(engine.sync_engine, 'async')
+if engine.dialect.name == 'mysql':
+    set_statement_timeout(engine.sync_engine, app.config['DB_STATEMENT_TIMEOUT'])
+elif sqlite_production_mode:
+    # Only reads are served here, like the read-only readers of app.py
+    sqlite_reader(
+        engine.sync_engine,
+        app.config['SQLITE_CACHE_MB'],
+        app.config['SQLITE_MMAP_MB'],
+        app.config['SQLITE_BUSY_TIMEOUT'],
+    )
+
+# Every other route, each request in its own thread
+wsgi_application = WsgiToAsgi(app)
+
+
+async def not_modified(*parts):
+    """Return 304 response if the client has the current page, else None
+    (see app.not_modified)."""
+
+    version, modified = await repository.data_version(session['user_id'])
+    return revalidate(version, modified, *parts)
+
+
+async def cache_years():
+    """Cache the years of expenses for the templates, whose context
+    processor (app.inject_years) can't await the query."""
+
+    await repository.expense_years(session['user_id'], g.get('data_version'))
+
+
+@login_required
+async def index():
+    """Show current month view of expenses (see app.index)."""
+
+    try:
+        year, month_no = month_view()
+    except ValueError as error:
+        return sorry(str(error))
+
+    # Nothing to do if the user's data didn't change since the last view
+    response = await not_modified('index', year, month_no)
+    if response is not None:
+        return response
+
+    cat_list = await repository.category_names(
+        session['user_id'], g.data_version
+    )
+    month_expenses, total_expenses = await repository.month_grid(
+        session['user_id'],
+        year,
+        month_no,
+        cat_list,
+    )
+    await cache_years()
+
+    return index_page(year, month_no, cat_list, month_expenses, total_expenses)
+
+
+@login_required
+async def structure():
+    """Generate pie chart (see app.structure)."""
+
+    year, mobile = pie_view()
+
+    # Nothing to do if the user's data didn't change since the last view
+    response = await not_modified('structure', year, mobile)
+    if response is not None:
+        return response
+
+    await cache_years()
+    if app.config['CHART_RENDERER'] == 'client':
+        return pie_page(year, mobile)
+
+    plot_data = await repository.category_sums(session['user_id'], year)
+
+    # Rendering the chart (or waiting for the render pool) blocks, so
+    # the page is made in a thread
+    return await asyncio.to_thread(pie_page, year, mobile, plot_data)
+
+
+@login_required
+async def categories():
+    """Show expense categories (GET of app.categories)."""
+
+    cat_list = await repository.category_names(session['user_id'])
+    await cache_years()
+
+    return categories_page(cat_list)
+
+
+# Routes served by coroutines (GET and HEAD only)
+ASYNC_ROUTES = {
+    '/': index,
+    '/structure': structure,
+    '/categories': categories,
+}
+
+
+def build_environ(scope):
+    """Return WSGI environ of a request without body."""
+
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('127.0.0.1', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode().decode('latin1'),
+        'PATH_INFO': scope['path'].encode().decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('latin1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f'HTTP/{scope["http_version"]}',
+        'REMOTE_ADDR': client[0],
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin1')
+        if name in environ:
+            separator = '; ' if name == 'HTTP_COOKIE' else ','
+            value = environ[name] + separator + value
+        environ[name] = value
+    return environ
+
+
+def open_session(request):
+    """Return session of the request, loaded as RequestContext.push()
+    loads it."""
+
+    interface = app.session_interface
+    with app.app_context():
+        loaded = interface.open_session(app, request)
+    if loaded is None:
+        loaded = interface.make_null_session(app)
+    return loaded
+
+
+async def dispatch(view, scope, send):
+    """Run the view like Flask runs its views and send the response.
+
+    The request context (session, before and after request functions,
+    teardown) is the one of app.py. The view is awaited, the session is
+    loaded and saved (file, database or Redis I/O) in threads.
+    """
+
+    request = app.request_class(build_environ(scope))
+    request.json_module = app.json
+    error = None
+    try:
+        loaded = await asyncio.to_thread(open_session, request)
+    except Exception as e:
+        # Handled below, as Flask handles errors of ctx.push()
+        error = e
+        loaded = app.session_interface.make_null_session(app)
+    ctx = RequestContext(app, request.environ, request, loaded)
+    try:
+        try:
+            ctx.push()
+            if error is not None:
+                raise error
+            try:
+                request_started.send(app, _async_wrapper=app.ensure_sync)
+                rv = app.preprocess_request()
+                if rv is None:
+                    # A redirect to the login page is not awaitable
+                    rv = view()
+                    if inspect.isawaitable(rv):
+                        rv = await rv
+            except Exception as e:
+                rv = app.handle_user_exception(e)
+            # After request functions and saving the session
+            response = await asyncio.to_thread(app.finalize_request, rv)
+        except Exception as e:
+            error = e
+            response = await asyncio.to_thread(app.handle_exception, e)
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [
+                (name.lower().encode('latin1'), value.encode('latin1'))
+                for name, value in response.headers.items()
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'' if scope['method'] == 'HEAD'
+                    else b''.join(response.iter_encoded()),
+        })
+        response.close()
+    finally:
+        ctx.pop(error)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await engine.dispose()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ASGI application: dashboard pages async, the rest through WSGI."""
+
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    view = None
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        view = ASYNC_ROUTES.get(scope['path'])
+    if view is not None:
+        return await dispatch(view, scope, send)
+
+    # A thread of its own for every request, instead of one for all
+    async with ThreadSensitiveContext():
+        await wsgi_application(scope, receive, send)
@@ -0,0 +1,4 @@
+"""Performance benchmarks of the Home Budget application.
+
+Run from the project root, e.g. 'python -m benchmarks.query_plans'.
+"""
@@ -0,0 +1,89 @@
+"""Latency of '/analytics' over ten years for a heavy user.
+
+Usage:
+    python -m benchmarks.analytics_latency [--rows 1000000] [--repeat 50]
+
+One user gets '--rows' expenses in '--categories' categories over
+'--years' years in a temporary SQLite database. '/analytics' for the
+whole range is requested '--repeat' times through the Flask test
+client (without validators, so every response is computed), and
+compared with fetching the same totals month by month from
+'/api/v1/summary'. The target is a p95 under 100 ms.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+import migrate
+
+from benchmarks.datagen import LAST_YEAR, populate
+from benchmarks.stats import latency_summary
+
+TARGET_MS = 100
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    uri = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    engine = create_engine(uri)
+    print(f'Populating with {args.rows} expenses of one user...')
+    populate(engine, args.rows, users=1, categories=args.categories,
+             years=args.years)
+    migrate.upgrade(engine)
+
+    os.environ.update({
+        'DATABASE_URL': uri,
+        'SESSION_BACKEND': 'sqlite',
+        'SESSION_SQLITE_PATH': os.path.join(directory, 'sessions.db'),
+    })
+    from app import app
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+
+    first_year = LAST_YEAR - args.years + 1
+    url = f'/analytics?from={first_year}&to={LAST_YEAR}&window=3'
+
+    # First request imports NumPy
+    response = client.get(url)
+    if response.status_code != 200:
+        raise SystemExit(f'{url}: {response.status}')
+    categories = len(response.get_json()['totals'])
+
+    seconds = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        client.get(url)
+        seconds.append(time.perf_counter() - start)
+    analytics = latency_summary(seconds)
+
+    # The same totals, one month at a time
+    start = time.perf_counter()
+    for year in range(first_year, LAST_YEAR + 1):
+        for month in range(1, 13):
+            client.get(f'/api/v1/summary?year={year}&month={month}')
+    by_month = time.perf_counter() - start
+
+    print(f'{categories} categories x {args.years * 12} months')
+    print('/analytics: mean {mean_ms:.1f} ms, p50 {p50_ms:.1f} ms, '
+          'p95 {p95_ms:.1f} ms, p99 {p99_ms:.1f} ms'.format(**analytics))
+    print(f'{args.years * 12} requests of /api/v1/summary: '
+          f'{by_month * 1000:.1f} ms')
+    print(f'target p95 < {TARGET_MS} ms: '
+          f'{"met" if analytics["p95_ms"] < TARGET_MS else "missed"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Compare latency of the JSON API with the HTML pages showing the same data.
+
+Usage:
+    python -m benchmarks.api_latency [--rows 100000] [--repeat 200]
+
+One user gets '--rows' expenses in a temporary SQLite database. Every
+pair of routes is requested '--repeat' times through the Flask test
+client, then the JSON routes are requested again with the ETag of the
+previous response (answered with 304 Not Modified).
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+import migrate
+
+from benchmarks.datagen import populate
+from benchmarks.stats import latency_summary
+
+# (label, url) of routes showing the same data
+PAIRS = [
+    ('month (html)', '/?disp_year=2024&months_radio=January'),
+    ('month (json)', '/api/v1/summary?year=2024&month=1'),
+    ('categories (html)', '/categories'),
+    ('categories (json)', '/api/v1/categories'),
+    ('expenses page (json)', '/api/v1/expenses?year=2024&month=1&limit=100'),
+]
+
+
+def measure(client, url, repeat, headers=None):
+    """Return latencies (seconds) and size of the last response."""
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url, headers=headers)
+        seconds.append(time.perf_counter() - start)
+        body = response.get_data()
+        if response.status_code not in (200, 304):
+            raise SystemExit(f'{url}: {response.status}')
+    return seconds, len(body)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine(uri)
+    print(f'Populating with {args.rows} expenses of one user...')
+    populate(engine, args.rows, users=1, categories=20, years=2)
+    migrate.upgrade(engine)
+
+    os.environ['DATABASE_URL'] = uri
+    from app import app
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+
+    print(f'{"route":24} {"bytes":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for label, url in PAIRS:
+        seconds, size = measure(client, url, args.repeat)
+        stats = latency_summary(seconds)
+        print(
+            f'{label:24} {size:8} {stats["p50_ms"]:8.2f} '
+            f'{stats["p95_ms"]:8.2f} {stats["p99_ms"]:8.2f}'
+        )
+
+        # Revalidate with the ETag of the JSON response
+        if 'json' in label:
+            etag = client.get(url).headers['ETag']
+            seconds, size = measure(
+                client, url, args.repeat, headers={'If-None-Match': etag}
+            )
+            stats = latency_summary(seconds)
+            print(
+                f'{label + " 304":24} {size:8} {stats["p50_ms"]:8.2f} '
+                f'{stats["p95_ms"]:8.2f} {stats["p99_ms"]:8.2f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+"""Compare concurrent dashboard loads served by the WSGI and ASGI entry points.
+
+Usage:
+    python -m benchmarks.asgi_load [--concurrency 200] [--requests 2000]
+    python -m benchmarks.asgi_load --database-uri mysql+mysqlconnector://...
+
+Synthetic data is generated into a temporary SQLite database, or into
+the empty database given with '--database-uri'. The same application
+is started twice, as separate processes:
+
+- wsgi: app.py on the threaded WSGI server of Werkzeug (a thread per
+  request).
+- asgi: asgi.py on uvicorn (dashboard pages as coroutines on the async
+  engine, in one process).
+
+'--concurrency' clients, each logged in as a random user, then load
+'/', '/structure' and '/categories' until '--requests' requests are
+done. Throughput, latency and failed requests are printed per server.
+Pie charts are drawn by the browser (CHART_RENDERER=client), so the
+benchmark measures the database and the server, not Matplotlib.
+"""
+
+import argparse
+import asyncio
+import calendar
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+
+from sqlalchemy import create_engine
+
+import migrate
+
+from benchmarks.datagen import LAST_YEAR, PASSWORD, populate
+from benchmarks.stats import latency_summary
+
+SERVERS = ['wsgi', 'asgi']
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def serve_wsgi(port):
+    """Serve app.py with the threaded server of Werkzeug (subprocess)."""
+
+    from werkzeug.serving import make_server
+
+    from app import app
+
+    # No line per request, like uvicorn with '--log-level warning'
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def start(server, port):
+    """Start the server in a subprocess and wait until it accepts."""
+
+    if server == 'wsgi':
+        command = [
+            sys.executable, '-m', 'benchmarks.asgi_load', '--serve-wsgi',
+            str(port),
+        ]
+    else:
+        command = [
+            sys.executable, '-m', 'uvicorn', 'asgi:application',
+            '--port', str(port), '--log-level', 'warning',
+            '--backlog', '4096',
+        ]
+    process = subprocess.Popen(command)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit(f'{server} server did not start')
+
+
+async def http(port, method, path, cookie=None, form=None):
+    """Return status and headers of a request (the body is read too)."""
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = urllib.parse.urlencode(form).encode() if form else b''
+    headers = [
+        f'{method} {path} HTTP/1.1',
+        'Host: 127.0.0.1',
+        'Connection: close',
+        f'Content-Length: {len(body)}',
+    ]
+    if form:
+        headers.append('Content-Type: application/x-www-form-urlencoded')
+    if cookie:
+        headers.append(f'Cookie: {cookie}')
+    writer.write(('\r\n'.join(headers) + '\r\n\r\n').encode() + body)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head = response.split(b'\r\n\r\n', 1)[0].decode('latin1').split('\r\n')
+    status = int(head[0].split()[1])
+    return status, [line.split(': ', 1) for line in head[1:]]
+
+
+async def login(port, user_id):
+    """Log in as the generated user, return the session cookie."""
+
+    status, headers = await http(port, 'POST', '/login', form={
+        'username': f'user{user_id}', 'password': PASSWORD,
+    })
+    for name, value in headers:
+        if name.lower() == 'set-cookie':
+            return value.split(';', 1)[0]
+    raise SystemExit(f'Login failed ({status})')
+
+
+async def load(port, args):
+    """Return latencies (seconds), failures and wall time of the load."""
+
+    rng = random.Random(0)
+    cookies = await asyncio.gather(*[
+        login(port, rng.randint(1, args.users))
+        for _ in range(args.concurrency)
+    ])
+
+    remaining = args.requests
+    seconds = []
+    failures = {}
+
+    def path():
+        year = rng.randint(LAST_YEAR - args.years + 1, LAST_YEAR)
+        return rng.choice([
+            f'/?disp_year={year}'
+            f'&months_radio={calendar.month_name[rng.randint(1, 12)]}',
+            '/structure',
+            '/categories',
+        ])
+
+    async def client(cookie):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                status, _ = await http(port, 'GET', path(), cookie)
+            except OSError as error:
+                status = type(error).__name__
+            seconds.append(time.perf_counter() - start)
+            if status != 200:
+                failures[status] = failures.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[client(cookie) for cookie in cookies])
+    return seconds, failures, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-uri', help='empty database to fill')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--servers', nargs='+', choices=SERVERS, default=SERVERS)
+    parser.add_argument('--serve-wsgi', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve_wsgi:
+        return serve_wsgi(args.serve_wsgi)
+
+    directory = tempfile.mkdtemp()
+    uri = args.database_uri or 'sqlite:///' + os.path.join(directory, 'bench.db')
+    engine = create_engine(uri)
+    print(f'Generating {args.rows} expenses of {args.users} users...')
+    populate(engine, args.rows, args.users, args.categories, args.years)
+    migrate.upgrade(engine)
+    engine.dispose()
+
+    # Read by the servers on import
+    os.environ.update({
+        'DATABASE_URL': uri,
+        'SESSION_BACKEND': 'sqlite',
+        'SESSION_SQLITE_PATH': os.path.join(directory, 'sessions.db'),
+        'CHART_RENDERER': 'client',
+    })
+
+    print(f'{args.requests} requests, {args.concurrency} concurrent clients')
+    print(f'{"server":8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} '
+          f'{"p99 ms":>8} {"failed":>7}')
+    for server in args.servers:
+        port = free_port()
+        process = start(server, port)
+        try:
+            seconds, failures, elapsed = asyncio.run(load(port, args))
+        finally:
+            process.terminate()
+            process.wait()
+        stats = latency_summary(seconds)
+        print(
+            f'{server:8} {len(seconds) / elapsed:8.1f} {stats["p50_ms"]:8.2f} '
+            f'{stats["p95_ms"]:8.2f} {stats["p99_ms"]:8.2f} '
+            f'{sum(failures.values()):7d}'
+        )
+        for status, count in sorted(failures.items(), key=str):
+            print(f'  {count} x {status}')
+
+
+if __name__ == '__main__':
+    main()
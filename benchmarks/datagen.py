@@ -0,0 +1,178 @@
+"""Generate synthetic users, categories and expenses for benchmarks.
+
+Usage:
+    python -m benchmarks.datagen budget.db [--rows 10000000] [--users 1000]
+
+The database has the schema of 'cs50/budget.db' (all migrations are
+applied unless '--no-migrate' is given), so it can be used by the
+application with DATABASE_URL=sqlite:///budget.db. Data is generated
+from a fixed seed: the same arguments always give the same database.
+Every user has the password 'password'.
+"""
+
+import argparse
+import calendar
+import os
+import random
+import time
+
+from sqlalchemy import create_engine, text
+from werkzeug.security import generate_password_hash
+
+import migrate
+
+SCHEMA = [
+    """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY NOT NULL,
+        username TEXT NOT NULL,
+        hash TEXT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE categories (
+        id INTEGER PRIMARY KEY NOT NULL,
+        category TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id)
+    )
+    """,
+    """
+    CREATE TABLE expenses (
+        id INTEGER PRIMARY KEY NOT NULL,
+        user_id INTEGER NOT NULL,
+        year INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        day INTEGER NOT NULL,
+        category_id INTEGER NOT NULL,
+        expense REAL NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id),
+        FOREIGN KEY(category_id) REFERENCES categories(id)
+    )
+    """,
+]
+
+# Last year of generated expenses
+LAST_YEAR = 2024
+
+# Password of every generated user
+PASSWORD = 'password'
+
+
+def create_schema(engine):
+    """Create the tables of an empty database."""
+
+    with engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(text(statement))
+
+
+def populate(engine, rows, users, categories, years, chunk=50000, seed=0):
+    """Create the tables and fill them with random expenses.
+
+    Users are 'user1'...'userN' with ids 1...N, category i of user u is
+    'Category i' with id (u - 1) * categories + i. Expenses are spread
+    evenly over users, categories and the days of the last 'years' years.
+    """
+
+    create_schema(engine)
+
+    # Hashing is slow on purpose, every user gets the same hash
+    password_hash = generate_password_hash(PASSWORD)
+    with engine.begin() as conn:
+        conn.execute(
+            text("INSERT INTO users (id, username, hash) VALUES (:id, :u, :hash)"),
+            [
+                {'id': i, 'u': f'user{i}', 'hash': password_hash}
+                for i in range(1, users + 1)
+            ]
+        )
+        conn.execute(
+            text(
+                """
+                INSERT INTO categories (id, category, user_id)
+                VALUES (:id, :category, :user_id)
+                """
+            ),
+            [
+                {
+                    'id': (user_id - 1) * categories + i,
+                    'category': f'Category {i}',
+                    'user_id': user_id,
+                }
+                for user_id in range(1, users + 1)
+                for i in range(1, categories + 1)
+            ]
+        )
+
+    rng = random.Random(seed)
+    first_year = LAST_YEAR - years + 1
+    month_days = {
+        (year, month): calendar.monthrange(year, month)[1]
+        for year in range(first_year, LAST_YEAR + 1)
+        for month in range(1, 13)
+    }
+    inserted = 0
+    while inserted < rows:
+        batch = []
+        for _ in range(min(chunk, rows - inserted)):
+            user_id = rng.randint(1, users)
+            year = rng.randint(first_year, LAST_YEAR)
+            month = rng.randint(1, 12)
+            batch.append({
+                'user_id': user_id,
+                'year': year,
+                'month': month,
+                'day': rng.randint(1, month_days[year, month]),
+                'category_id': (user_id - 1) * categories
+                               + rng.randint(1, categories),
+                'expense': round(rng.uniform(1, 200), 2),
+            })
+        with engine.begin() as conn:
+            # Nothing to lose if a generated database is cut short
+            if engine.dialect.name == 'sqlite':
+                conn.exec_driver_sql('PRAGMA synchronous = OFF')
+            conn.execute(
+                text(
+                    """
+                    INSERT INTO expenses (user_id, year, month, day, category_id, expense)
+                    VALUES (:user_id, :year, :month, :day, :category_id, :expense)
+                    """
+                ),
+                batch
+            )
+        inserted += len(batch)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='SQLite database file to create')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--no-migrate', action='store_true',
+        help="leave the schema of 'cs50/budget.db' without migrations",
+    )
+    args = parser.parse_args(argv)
+
+    if os.path.exists(args.path):
+        parser.error(f'{args.path} already exists')
+    engine = create_engine('sqlite:///' + args.path)
+
+    start = time.perf_counter()
+    populate(
+        engine, args.rows, args.users, args.categories, args.years,
+        seed=args.seed,
+    )
+    print(f'Generated {args.rows} expenses in {time.perf_counter() - start:.1f} s')
+    if not args.no_migrate:
+        start = time.perf_counter()
+        migrate.upgrade(engine)
+        print(f'Migrated in {time.perf_counter() - start:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Measure throughput and peak memory of the streaming export.
+
+Usage:
+    python -m benchmarks.export_throughput [--rows 2000000]
+
+One user gets '--rows' expenses in a temporary SQLite database, then
+the whole history is exported through the Flask test client as CSV and
+as NDJSON. Peak RSS is reported after each export; with streaming it
+shouldn't grow with the number of rows.
+"""
+
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+import migrate
+
+from benchmarks.datagen import populate
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000000)
+    parser.add_argument('--years', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine(uri)
+    print(f'Populating with {args.rows} expenses of one user...')
+    populate(engine, args.rows, users=1, categories=20, years=args.years)
+    migrate.upgrade(engine)
+
+    os.environ['DATABASE_URL'] = uri
+    from app import app
+
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = 1
+
+    print(f'peak RSS before export: {peak_rss_mb():.0f} MB')
+    for file_format in ('csv', 'ndjson'):
+        start = time.perf_counter()
+        response = client.get(f'/export?format={file_format}', buffered=False)
+        size = 0
+        lines = 0
+        for chunk in response.response:
+            size += len(chunk)
+            lines += chunk.count(b'\n')
+        response.close()
+        elapsed = time.perf_counter() - start
+        print(
+            f'{file_format:7} {lines} lines, {size / 2**20:.0f} MB in '
+            f'{elapsed:.1f} s ({lines / elapsed:.0f} rows/s), '
+            f'peak RSS {peak_rss_mb():.0f} MB'
+        )
+
+
+if __name__ == '__main__':
+    main()
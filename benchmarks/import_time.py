@@ -0,0 +1,72 @@
+"""Measure startup time and memory of the application with and without
+the charting stack loaded.
+
+Usage:
+    python -m benchmarks.import_time [--repeat 5]
+
+Every scenario runs in a fresh interpreter. The application is imported
+with a temporary SQLite database, so no MySQL driver is needed.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+SCENARIOS = {
+    'app (charts loaded lazily)': 'import app',
+    'app + charting stack': 'import app; import charts; charts.preload_charts()',
+    'app + first chart rendered': (
+        'import app; import charts; charts.render_pie({"A": 1, "B": 2}, False)'
+    ),
+}
+
+PROBE = """
+import json, resource, time
+start = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - start
+# ru_maxrss is in kilobytes on Linux
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+print(json.dumps({{'seconds': elapsed, 'rss_mb': rss}}))
+"""
+
+
+def measure(code, env):
+    """Return (seconds, peak RSS in MB) of running 'code' in a new process."""
+
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE.format(code=code)],
+        capture_output=True,
+        check=True,
+        env=env,
+        text=True,
+    ).stdout
+    result = json.loads(output.splitlines()[-1])
+    return result['seconds'], result['rss_mb']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env['DATABASE_URL'] = 'sqlite:///' + os.path.join(
+        tempfile.mkdtemp(), 'bench.db'
+    )
+    env.pop('CHART_PRELOAD', None)
+
+    print(f'{"scenario":32} {"time (ms)":>10} {"RSS (MB)":>10}')
+    for name, code in SCENARIOS.items():
+        runs = [measure(code, env) for _ in range(args.repeat)]
+        seconds = statistics.median(run[0] for run in runs)
+        rss = statistics.median(run[1] for run in runs)
+        print(f'{name:32} {seconds * 1000:10.1f} {rss:10.1f}')
+
+
+if __name__ == '__main__':
+    main()
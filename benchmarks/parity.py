@@ -0,0 +1,186 @@
+"""Check that repository.py gives the same results on every backend.
+
+Usage:
+    python -m benchmarks.parity
+    python -m benchmarks.parity --database-uri mysql+mysqlconnector://...
+
+The same synthetic data is generated into a temporary SQLite database
+and into every (empty) database given with '--database-uri'. The same
+reads and writes are run through Repository on each of them and the
+results are compared with the SQLite ones. On every backend the month
+grids (read from 'expenses') are also checked against the sums read
+from the rollups. Exit status is 1 if anything differs.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+from decimal import Decimal
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+
+import migrate
+
+from benchmarks.datagen import LAST_YEAR, populate
+from repository import Repository, values_cache
+
+
+def normalize(value):
+    """Return value comparable across drivers (rows as tuples, money
+    rounded to cents)."""
+
+    if isinstance(value, (float, Decimal)):
+        return round(float(value), 2)
+    if isinstance(value, dict):
+        return {key: normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)) or hasattr(value, '_mapping'):
+        return [normalize(item) for item in value]
+    return value
+
+
+def scenario(repository, users, years):
+    """Run reads and writes, return dict of their results by name."""
+
+    results = {}
+    first_year = LAST_YEAR - years + 1
+
+    def record(name, value):
+        results[name] = normalize(value)
+
+    for user_id in range(1, users + 1):
+        cat_list = repository.category_names(user_id)
+        record(f'{user_id} categories', repository.categories(user_id))
+        record(f'{user_id} years', repository.expense_years(user_id))
+        for year in (first_year, LAST_YEAR):
+            record(f'{user_id} {year} sums', repository.category_sums(user_id, year))
+            for month_no in (2, 7):
+                record(
+                    f'{user_id} {year}-{month_no} grid',
+                    repository.month_grid(user_id, year, month_no, cat_list),
+                )
+                record(
+                    f'{user_id} {year}-{month_no} sums',
+                    repository.category_sums(user_id, year, month_no),
+                )
+        record(
+            f'{user_id} month totals',
+            sorted(repository.month_totals(user_id, first_year, LAST_YEAR)),
+        )
+        page, after_id = repository.expenses_page(user_id, 0, 50, LAST_YEAR)
+        record(f'{user_id} page', [page, after_id])
+
+    # Writes of the routes, then the reads they change
+    user_id = 1
+    repository.add_category(user_id, 'Parity')
+    record('delete empty category', [
+        repository.delete_category(user_id, 'Category 1'),
+        repository.delete_category(user_id, 'Parity'),
+    ])
+    repository.add_category(user_id, 'Parity')
+    parity_id = [
+        row.id for row in repository.categories(user_id) if row.category == 'Parity'
+    ][0]
+    repository.add_expenses(user_id, [
+        {
+            'user_id': user_id, 'year': LAST_YEAR, 'month': 2, 'day': day,
+            'category_id': parity_id, 'expense': 10.25 * day,
+        }
+        for day in (1, 1, 29)
+    ])
+    repository.rename_category(user_id, 'Parity', 'Renamed')
+    cat_list = repository.category_names(user_id)
+    record('grid after writes', repository.month_grid(user_id, LAST_YEAR, 2, cat_list))
+    record('sums after writes', repository.category_sums(user_id, LAST_YEAR, 2))
+
+    page, _ = repository.expenses_page(user_id, 0, 10000, LAST_YEAR, 2)
+    day_one = [row.id for row in page if row.category_id == parity_id and row.day == 1]
+    expense, same_day = repository.expense_day(user_id, day_one[0])
+    record('expense day', [expense, sorted(row.expense for row in same_day)])
+    record('delete expense', repository.delete_expense(user_id, day_one[0]))
+    record('delete foreign expense', repository.delete_expense(2, day_one[1]))
+    record('sums after delete', repository.category_sums(user_id, LAST_YEAR, 2))
+
+    repository.create_user('parity', 'hash')
+    try:
+        repository.create_user('parity', 'hash')
+        record('duplicate user', 'accepted')
+    except IntegrityError:
+        record('duplicate user', 'rejected')
+    record('find user', repository.find_user('parity')[1:])
+    record('data version', repository.data_version(user_id)[0])
+    return results
+
+
+def check_rollups(repository, users, years):
+    """Return mismatches between month grids and rollup sums."""
+
+    mismatches = []
+    for user_id in range(1, users + 1):
+        cat_list = repository.category_names(user_id)
+        for year in range(LAST_YEAR - years + 1, LAST_YEAR + 1):
+            for month_no in range(1, 13):
+                _, totals = repository.month_grid(user_id, year, month_no, cat_list)
+                totals = {
+                    category: round(float(total), 2)
+                    for category, total in totals.items() if total
+                }
+                sums = {
+                    category: round(float(total), 2)
+                    for category, total in repository.category_sums(
+                        user_id, year, month_no
+                    ).items()
+                }
+                if totals != sums:
+                    mismatches.append(f'user {user_id} {year}-{month_no:02d}')
+    return mismatches
+
+
+def run(uri, args):
+    engine = create_engine(uri)
+    populate(engine, args.rows, args.users, args.categories, args.years)
+    migrate.upgrade(engine)
+    # Every backend starts with empty caches
+    values_cache.clear()
+    repository = Repository(engine)
+    results = scenario(repository, args.users, args.years)
+    return results, check_rollups(repository, args.users, args.years)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--database-uri', action='append', default=[],
+        help='empty database to compare with SQLite (repeatable)',
+    )
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--categories', type=int, default=6)
+    parser.add_argument('--years', type=int, default=2)
+    args = parser.parse_args(argv)
+
+    reference_uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'parity.db')
+    failed = False
+    reference = None
+    for uri in [reference_uri] + args.database_uri:
+        name = uri.split('://')[0]
+        results, mismatches = run(uri, args)
+        for mismatch in mismatches:
+            print(f'{name}: rollups differ from expenses in {mismatch}')
+        if reference is None:
+            reference = results
+        else:
+            for key, value in reference.items():
+                if results.get(key) != value:
+                    print(f'{name}: {key} differs from sqlite')
+                    mismatches.append(key)
+        failed = failed or bool(mismatches)
+        print(f'{name}: {len(results)} results, {len(mismatches)} mismatches')
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
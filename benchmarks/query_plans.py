@@ -0,0 +1,117 @@
+"""Show query plans and timings before and after the index migrations.
+
+Usage:
+    python -m benchmarks.query_plans --rows 10000000
+    python -m benchmarks.query_plans --database-uri mysql+mysqlconnector://...
+
+Without '--database-uri' a temporary SQLite database is created.
+The database must be empty, it is filled with synthetic expenses.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+import migrate
+
+from benchmarks.datagen import populate
+
+# Queries issued by the routes, with the parameters used for the benchmark
+QUERIES = {
+    'index: month grid': """
+        SELECT category, day, MIN(expenses.id) AS expense_id,
+               SUM(expense) AS expense
+          FROM expenses
+          JOIN categories
+            ON expenses.category_id = categories.id
+           AND expenses.user_id = categories.user_id
+         WHERE expenses.user_id = :user_id
+           AND year = :year
+           AND month = :month
+         GROUP BY category, day
+    """,
+    'structure: yearly sum': """
+        SELECT SUM(expense) AS sum
+          FROM expenses, categories
+         WHERE expenses.category_id = categories.id
+           AND expenses.user_id = categories.user_id
+           AND expenses.user_id = :user_id
+           AND year = :year
+           AND category = :category
+    """,
+    'delete_expense: same day': """
+        SELECT id, expense FROM expenses
+         WHERE user_id = :user_id
+           AND year = :year
+           AND month = :month
+           AND day = :day
+           AND category_id = :category_id
+    """,
+    'categories: by name': """
+        SELECT id FROM categories
+         WHERE user_id = :user_id
+           AND category = :category
+    """,
+}
+
+
+def report(engine, params, repeat):
+    """Print query plan and average time of every query."""
+
+    explain = 'EXPLAIN QUERY PLAN' if engine.dialect.name == 'sqlite' else 'EXPLAIN'
+    with engine.connect() as conn:
+        for name, query in QUERIES.items():
+            print(f'-- {name}')
+            for row in conn.execute(text(f'{explain} {query}'), params):
+                print('   ', ' | '.join(str(value) for value in row))
+            start = time.perf_counter()
+            for _ in range(repeat):
+                conn.execute(text(query), params).fetchall()
+            elapsed = (time.perf_counter() - start) / repeat
+            print(f'    {elapsed * 1000:.2f} ms')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-uri', help='empty database to use')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    uri = args.database_uri
+    if uri is None:
+        directory = tempfile.mkdtemp()
+        uri = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    engine = create_engine(uri)
+
+    print(f'Populating {uri} with {args.rows} expenses...')
+    start = time.perf_counter()
+    populate(engine, args.rows, args.users, args.categories, args.years)
+    print(f'Done in {time.perf_counter() - start:.1f} s')
+
+    params = {
+        'user_id': 1,
+        'year': 2024,
+        'month': 6,
+        'day': 15,
+        'category_id': 1,
+        'category': 'Category 1',
+    }
+
+    print('\n=== Before migrations ===')
+    report(engine, params, args.repeat)
+
+    migrate.upgrade(engine)
+
+    print('\n=== After migrations ===')
+    report(engine, params, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
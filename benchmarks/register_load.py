@@ -0,0 +1,82 @@
+"""Register thousands of users concurrently and report latency.
+
+Usage:
+    python -m benchmarks.register_load [--users 2000] [--concurrency 32]
+
+Registrations run through the Flask test client against a temporary
+SQLite database with all migrations applied. A share of requests
+('--duplicates') reuses usernames, so racing duplicates have to be
+rejected by the unique index.
+"""
+
+import argparse
+import concurrent.futures
+import os
+import random
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+import migrate
+
+from benchmarks.datagen import create_schema
+from benchmarks.stats import latency_summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument(
+        '--duplicates', type=float, default=0.1,
+        help='share of requests reusing an already used username',
+    )
+    args = parser.parse_args(argv)
+
+    uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    engine = create_engine(uri)
+    create_schema(engine)
+    migrate.upgrade(engine)
+
+    os.environ['DATABASE_URL'] = uri
+    from app import app
+
+    rng = random.Random(0)
+    names = [f'user{i}' for i in range(args.users)]
+    requests = names + rng.sample(names, int(args.users * args.duplicates))
+    rng.shuffle(requests)
+
+    def register(username):
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.post('/register', data={
+            'username': username,
+            'password': 'password',
+            'confirmation': 'password',
+        })
+        return time.perf_counter() - start, response.status_code
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as pool:
+        results = list(pool.map(register, requests))
+    elapsed = time.perf_counter() - start
+
+    with engine.connect() as conn:
+        registered = conn.execute(text("SELECT COUNT(*) FROM users")).scalar()
+
+    summary = latency_summary([seconds for seconds, _ in results])
+    rejected = sum(1 for _, status in results if status == 400)
+    print(f'{len(requests)} requests in {elapsed:.1f} s '
+          f'({len(requests) / elapsed:.0f} req/s), '
+          f'concurrency {args.concurrency}')
+    print('latency: mean {mean_ms:.1f} ms, p50 {p50_ms:.1f} ms, '
+          'p95 {p95_ms:.1f} ms, p99 {p99_ms:.1f} ms'.format(**summary))
+    print(f'registered {registered} of {len(names)} usernames, '
+          f'{rejected} duplicates rejected')
+    if registered != len(names):
+        raise SystemExit('Duplicate or missing users in the database.')
+
+
+if __name__ == '__main__':
+    main()
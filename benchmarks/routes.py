@@ -0,0 +1,244 @@
+"""Drive the main routes with synthetic data and report latency per route.
+
+Usage:
+    python -m benchmarks.routes [--rows 1000000] [--requests 200]
+    python -m benchmarks.routes --database budget.db --output new.json \\
+        --baseline old.json
+
+Without '--database' a database is generated by benchmarks.datagen
+(with the same '--rows', '--users', '--categories' and '--years'). A
+database passed with '--database' is copied first, so it can be reused
+by every run. Every route is requested '--requests' times, for random
+users and months, through the Flask test client in one thread.
+Throughput is requests per second of that one worker.
+
+Results are saved as JSON with '--output'. With '--baseline', the
+change of p50/p95 against a previous result file is printed too.
+"""
+
+import argparse
+import calendar
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+
+from sqlalchemy import bindparam, create_engine, text
+
+import migrate
+
+from benchmarks.datagen import LAST_YEAR, PASSWORD, populate
+from benchmarks.stats import latency_summary
+
+ROUTES = ['index', 'structure', 'add_expense', 'delete_expense', 'register']
+
+
+def git_commit():
+    """Return current commit of the working tree (None outside of git)."""
+
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Driver:
+    """Requests of one route for random users, through the test client."""
+
+    def __init__(self, app, engine, rng, years, deletes):
+        self.app = app
+        self.client = app.test_client()
+        self.rng = rng
+        self.years = years
+        with engine.connect() as conn:
+            self.users = conn.execute(
+                text("SELECT MAX(id) FROM users")
+            ).scalar()
+            self.categories = {}
+            for category_id, user_id in conn.execute(
+                text("SELECT id, user_id FROM categories")
+            ):
+                self.categories.setdefault(user_id, []).append(category_id)
+            # Random expenses to delete, looked up by id
+            max_id = conn.execute(text("SELECT MAX(id) FROM expenses")).scalar()
+            ids = rng.sample(range(1, max_id + 1), min(deletes, max_id))
+            self.expenses = [
+                tuple(row) for row in conn.execute(
+                    text(
+                        "SELECT id, user_id FROM expenses WHERE id IN :ids"
+                    ).bindparams(bindparam('ids', expanding=True)),
+                    {'ids': ids}
+                )
+            ]
+        self.registered = 0
+
+    def login(self, user_id, view=None):
+        """Set the session of the client (not measured)."""
+
+        with self.client.session_transaction() as session:
+            session.clear()
+            if user_id is not None:
+                session['user_id'] = user_id
+            if view is not None:
+                session['view'] = view
+
+    def random_view(self):
+        return {
+            'year': self.rng.choice(self.years),
+            'month': self.rng.randint(1, 12),
+        }
+
+    def prepare(self, route):
+        """Return (method, url, form data) of the next request of the route."""
+
+        user_id = self.rng.randint(1, self.users)
+        if route == 'index':
+            self.login(user_id)
+            view = self.random_view()
+            return 'GET', (
+                f'/?disp_year={view["year"]}'
+                f'&months_radio={calendar.month_name[view["month"]]}'
+            ), None
+        if route == 'structure':
+            self.login(user_id, self.random_view())
+            return 'GET', '/structure', None
+        if route == 'add_expense':
+            self.login(user_id)
+            view = self.random_view()
+            return 'POST', '/add', {
+                'date': f'{view["year"]}-{view["month"]:02d}-'
+                        f'{self.rng.randint(1, 28):02d}',
+                'category_id': str(self.rng.choice(self.categories[user_id])),
+                'expense': f'{self.rng.uniform(1, 200):.2f}',
+            }
+        if route == 'delete_expense':
+            expense_id, user_id = self.expenses.pop()
+            self.login(user_id)
+            return 'POST', '/delete/expense', {
+                'del_chosen_expense': str(expense_id)
+            }
+        if route == 'register':
+            self.login(None)
+            self.registered += 1
+            return 'POST', '/register', {
+                'username': f'bench{self.registered}',
+                'password': PASSWORD,
+                'confirmation': PASSWORD,
+            }
+        raise ValueError(route)
+
+    def run(self, route, requests, warmup):
+        """Return latencies (seconds) of 'requests' requests of the route."""
+
+        seconds = []
+        for i in range(warmup + requests):
+            method, url, data = self.prepare(route)
+            start = time.perf_counter()
+            response = self.client.open(url, method=method, data=data)
+            elapsed = time.perf_counter() - start
+            if response.status_code >= 400:
+                raise SystemExit(f'{route}: {method} {url} {response.status}')
+            if i >= warmup:
+                seconds.append(elapsed)
+        return seconds
+
+
+def compare(results, baseline):
+    """Print change of latency against the baseline results."""
+
+    print(f'\nAgainst {baseline.get("commit") or "baseline"}:')
+    for route, stats in results['routes'].items():
+        before = baseline['routes'].get(route)
+        if before is None:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms'):
+            if before[key]:
+                change = (stats[key] - before[key]) / before[key] * 100
+                changes.append(f'{key[:3]} {change:+6.1f}%')
+        print(f'{route:16} ' + '  '.join(changes))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database', help='SQLite database made by datagen')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument(
+        '--routes', nargs='+', choices=ROUTES, default=ROUTES,
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to save the results (JSON)')
+    parser.add_argument('--baseline', help='results of a previous run (JSON)')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'budget.db')
+    uri = 'sqlite:///' + path
+    engine = create_engine(uri)
+    if args.database:
+        shutil.copyfile(args.database, path)
+    else:
+        print(f'Generating {args.rows} expenses of {args.users} users...')
+        populate(engine, args.rows, args.users, args.categories, args.years)
+        migrate.upgrade(engine)
+
+    with engine.connect() as conn:
+        first_year, last_year = conn.execute(
+            text("SELECT MIN(year), MAX(year) FROM expenses")
+        ).one()
+    years = list(range(first_year or LAST_YEAR, (last_year or LAST_YEAR) + 1))
+
+    os.environ.update({
+        'DATABASE_URL': uri,
+        'SESSION_BACKEND': 'sqlite',
+        'SESSION_SQLITE_PATH': os.path.join(directory, 'sessions.db'),
+    })
+    # Config is read on import, after the environment is set
+    from app import app
+
+    driver = Driver(
+        app, engine, random.Random(args.seed), years,
+        deletes=args.requests + args.warmup,
+    )
+    results = {
+        'commit': git_commit(),
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'parameters': vars(args),
+        'routes': {},
+    }
+
+    print(f'{"route":16} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    for route in args.routes:
+        seconds = driver.run(route, args.requests, args.warmup)
+        stats = latency_summary(seconds)
+        stats['throughput_rps'] = len(seconds) / sum(seconds)
+        results['routes'][route] = stats
+        print(
+            f'{route:16} {stats["throughput_rps"]:8.1f} {stats["p50_ms"]:8.2f} '
+            f'{stats["p95_ms"]:8.2f} {stats["p99_ms"]:8.2f}'
+        )
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""Measure bytes written to the session store per request.
+
+Usage:
+    python -m benchmarks.session_payload [--years 10] [--requests 200]
+
+A logged-in user with expenses in '--years' years browses months,
+years and other pages through the Flask test client, with the SQLite
+session backend. The previous session layout (years list, selected year
+and one key per visited year, rewritten by every index() request) is
+computed for the same browsing for comparison.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+
+from sqlalchemy import create_engine, text
+
+import migrate
+
+from benchmarks.datagen import create_schema
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    uri = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    engine = create_engine(uri)
+    create_schema(engine)
+    migrate.upgrade(engine)
+
+    os.environ.update({
+        'DATABASE_URL': uri,
+        'SESSION_BACKEND': 'sqlite',
+        'SESSION_SQLITE_PATH': os.path.join(directory, 'sessions.db'),
+        'CHART_RENDERER': 'client',
+    })
+    # Config is read on import, after the environment is set
+    from app import app
+    from helpers import months
+    from sessions import serializer
+
+    # Count bytes passed to the session store
+    store = app.session_interface.store
+    written = [0]
+    store_set = store.set
+
+    def counting_set(sid, data, ttl):
+        written[-1] += len(data)
+        store_set(sid, data, ttl)
+    store.set = counting_set
+
+    client = app.test_client()
+    client.post('/register', data={
+        'username': 'user', 'password': 'pass', 'confirmation': 'pass',
+    })
+    client.post('/login', data={'username': 'user', 'password': 'pass'})
+    client.post('/categories', data={'category_name': 'food'})
+    years = list(range(2024 - args.years + 1, 2025))
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                """
+                INSERT INTO expenses (user_id, year, month, day, category_id, expense)
+                VALUES (1, :year, 1, 1, 1, 10)
+                """
+            ),
+            [{'year': year} for year in years]
+        )
+
+    # Measure only the browsing
+    written.clear()
+    rng = random.Random(0)
+    legacy = {'_permanent': False, 'user_id': 1}
+    legacy_written = 0
+    for _ in range(args.requests):
+        page = rng.choice(['month', 'year', 'index', 'categories', 'add'])
+        if page == 'month':
+            month = rng.choice(months)
+            url = f'/?months_radio={month}'
+        elif page == 'year':
+            year = rng.choice(years)
+            url = f'/?disp_year={year}'
+        elif page == 'index':
+            url = '/'
+        else:
+            url = f'/{page}'
+
+        written.append(0)
+        client.get(url)
+
+        # Previous layout: index() rewrote years, year and month every time
+        if url.startswith('/?') or url == '/':
+            legacy['years'] = years
+            if page == 'year':
+                legacy['year'] = year
+            legacy.setdefault('year', 2024)
+            if page == 'month':
+                legacy[legacy['year']] = months.index(month) + 1
+            legacy.setdefault(legacy['year'], 1)
+            legacy_written += len(serializer.dumps(legacy))
+
+    writes = sum(1 for size in written if size)
+    print(f'{args.requests} requests, expenses in {args.years} years')
+    print(f'previous layout: {legacy_written / args.requests:8.1f} bytes/request')
+    print(f'current layout : {sum(written) / args.requests:8.1f} bytes/request '
+          f'({writes} of {args.requests} requests wrote the session)')
+
+
+if __name__ == '__main__':
+    main()
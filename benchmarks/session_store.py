@@ -0,0 +1,97 @@
+"""Compare latency of session backends with many stored sessions.
+
+Usage:
+    python -m benchmarks.session_store [--sessions 100000]
+    python -m benchmarks.session_store --redis-url redis://localhost:6379/15
+
+Every backend gets '--sessions' sessions written, then the same number
+of random reads and random rewrites. The filesystem backend is the
+cachelib FileSystemCache used by Flask-Session (without a file limit).
+Redis is measured only if '--redis-url' is given; any server speaking
+the Redis protocol can be used.
+"""
+
+import argparse
+import os
+import random
+import secrets
+import tempfile
+import time
+
+from sessions import RedisSessionStore, SqliteSessionStore, serializer
+
+from benchmarks.stats import latency_summary
+
+TTL = 3600
+
+
+class FileSystemStore:
+    """Adapter of cachelib's FileSystemCache to the store interface."""
+
+    def __init__(self, directory):
+        from cachelib import FileSystemCache
+        self.cache = FileSystemCache(directory, threshold=0, default_timeout=TTL)
+
+    def get(self, sid):
+        return self.cache.get(sid)
+
+    def set(self, sid, data, ttl):
+        self.cache.set(sid, data, timeout=ttl)
+
+
+def run(store, sids, payload, rng):
+    """Return dict of latency summaries of write, read and rewrite."""
+
+    results = {}
+    for phase in ('write', 'read', 'rewrite'):
+        order = sids if phase == 'write' else rng.sample(sids, len(sids))
+        seconds = []
+        for sid in order:
+            start = time.perf_counter()
+            if phase == 'read':
+                store.get(sid)
+            else:
+                store.set(sid, payload, TTL)
+            seconds.append(time.perf_counter() - start)
+        results[phase] = latency_summary(seconds)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--redis-url')
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    stores = {
+        'filesystem': FileSystemStore(os.path.join(directory, 'flask_session')),
+        'sqlite': SqliteSessionStore(os.path.join(directory, 'sessions.db')),
+    }
+    if args.redis_url:
+        stores['redis'] = RedisSessionStore(args.redis_url)
+
+    # A typical session of a logged-in user
+    payload = serializer.dumps({
+        '_permanent': False,
+        'user_id': 42,
+        'year': 2024,
+        2024: 6,
+        'years': [2020, 2021, 2022, 2023, 2024],
+    })
+    sids = [secrets.token_urlsafe(32) for _ in range(args.sessions)]
+
+    print(f'{args.sessions} sessions, latency in ms')
+    print(f'{"backend":12} {"phase":8} {"mean":>8} {"p50":>8} {"p99":>8} {"ops/s":>10}')
+    for name, store in stores.items():
+        results = run(store, sids, payload, random.Random(0))
+        for phase, summary in results.items():
+            print(
+                f'{name:12} {phase:8} {summary["mean_ms"]:8.3f} '
+                f'{summary["p50_ms"]:8.3f} {summary["p99_ms"]:8.3f} '
+                f'{1000 / summary["mean_ms"]:10.0f}'
+            )
+
+
+if __name__ == '__main__':
+    main()
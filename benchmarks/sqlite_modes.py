@@ -0,0 +1,153 @@
+"""Compare mixed read/write throughput of SQLite in default and production mode.
+
+Usage:
+    python -m benchmarks.sqlite_modes [--readers 8] [--writers 2] [--seconds 10]
+
+One synthetic database is generated and copied for every mode, then
+'--readers' threads read month views (the queries of '/') and
+'--writers' threads add expenses (the transaction of '/add') through
+Repository for '--seconds' seconds:
+
+- default: one engine with the default rollback journal, as the cs50
+  variant used it before.
+- production: WAL journal, tuned pragmas, a pool of read-only
+  connections and a single writer (SQLITE_PRODUCTION=1).
+
+Operations per second, p95 latency and failed operations (e.g.
+'database is locked') are printed per mode.
+"""
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+
+import migrate
+
+from benchmarks.datagen import LAST_YEAR, populate
+from benchmarks.stats import latency_summary
+from database import SQLITE_WRITER_POOL, sqlite_production
+from repository import Repository, values_cache
+
+MODES = ['default', 'production']
+
+
+def make_repository(mode, uri, readers):
+    if mode == 'default':
+        return Repository(create_engine(uri))
+    engine = create_engine(uri, **SQLITE_WRITER_POOL)
+    return Repository(
+        engine, sqlite_production(engine, {'pool_size': readers})
+    )
+
+
+def run(repository, args):
+    """Return dict of latencies and failures of reads and writes."""
+
+    stop = threading.Event()
+    results = {
+        kind: {'seconds': [], 'failed': 0} for kind in ('reads', 'writes')
+    }
+    lock = threading.Lock()
+
+    def record(kind, operation):
+        start = time.perf_counter()
+        try:
+            operation()
+        except OperationalError:
+            with lock:
+                results[kind]['failed'] += 1
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            results[kind]['seconds'].append(elapsed)
+
+    def reader(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            user_id = rng.randint(1, args.users)
+            year = rng.randint(LAST_YEAR - args.years + 1, LAST_YEAR)
+            month_no = rng.randint(1, 12)
+
+            def read():
+                cat_list = repository.category_names(user_id)
+                repository.month_grid(user_id, year, month_no, cat_list)
+                repository.category_sums(user_id, year, month_no)
+            record('reads', read)
+
+    def writer(seed):
+        rng = random.Random(seed)
+        while not stop.is_set():
+            user_id = rng.randint(1, args.users)
+            expense = {
+                'user_id': user_id,
+                'year': LAST_YEAR,
+                'month': rng.randint(1, 12),
+                'day': rng.randint(1, 28),
+                'category_id': (user_id - 1) * args.categories
+                               + rng.randint(1, args.categories),
+                'expense': round(rng.uniform(1, 200), 2),
+            }
+            record('writes', lambda: repository.add_expenses(user_id, [expense]))
+
+    threads = [
+        threading.Thread(target=reader, args=(i,)) for i in range(args.readers)
+    ] + [
+        threading.Thread(target=writer, args=(1000 + i,))
+        for i in range(args.writers)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--years', type=int, default=3)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    args = parser.parse_args(argv)
+
+    directory = tempfile.mkdtemp()
+    template = os.path.join(directory, 'template.db')
+    engine = create_engine('sqlite:///' + template)
+    print(f'Generating {args.rows} expenses of {args.users} users...')
+    populate(engine, args.rows, args.users, args.categories, args.years)
+    migrate.upgrade(engine)
+    engine.dispose()
+
+    print(f'{args.readers} readers, {args.writers} writers, {args.seconds:g} s')
+    print(f'{"mode":12} {"kind":7} {"ops/s":>8} {"p50 ms":>8} '
+          f'{"p95 ms":>8} {"failed":>7}')
+    for mode in args.modes:
+        path = os.path.join(directory, f'{mode}.db')
+        shutil.copyfile(template, path)
+        # Every mode starts with empty caches
+        values_cache.clear()
+        repository = make_repository(mode, 'sqlite:///' + path, args.readers)
+        for kind, result in run(repository, args).items():
+            stats = latency_summary(result['seconds'])
+            print(
+                f'{mode:12} {kind:7} {len(result["seconds"]) / args.seconds:8.1f} '
+                f'{stats["p50_ms"]:8.2f} {stats["p95_ms"]:8.2f} '
+                f'{result["failed"]:7d}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+"""Statistics shared by the benchmarks."""
+
+
+def percentile(values, q):
+    """Return q-th percentile (0-100) of values, by linear interpolation."""
+
+    values = sorted(values)
+    if not values:
+        return 0.0
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def latency_summary(seconds):
+    """Return dict with count, mean and p50/p95/p99 latency in milliseconds."""
+
+    return {
+        'count': len(seconds),
+        'mean_ms': 1000 * sum(seconds) / len(seconds) if seconds else 0.0,
+        'p50_ms': 1000 * percentile(seconds, 50),
+        'p95_ms': 1000 * percentile(seconds, 95),
+        'p99_ms': 1000 * percentile(seconds, 99),
+    }
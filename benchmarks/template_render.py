@@ -0,0 +1,118 @@
+"""Measure render time of the month table in 'index.html'.
+
+Usage:
+    python -m benchmarks.template_render [--categories 40] [--repeat 50]
+
+The grid is filled with an expense on every day of every category,
+the worst case for the table. The previous template, which searched
+the expenses of a category for every day, is rendered for comparison.
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from collections import namedtuple
+
+# Body of the table of the previous template: for every day, a loop
+# over all expenses of the category to find the one of that day
+LEGACY_TABLE = """
+{% for category in cat_list %}
+<tr><th>{{ category }}</th>
+{% for day in range(1, month_days + 1) %}
+    {% set ns = namespace(found=0) %}
+    {% for expense in month_expenses[category] %}
+        {% if day == expense.day %}
+            <td><form action="/delete/expense" method="post">
+            <input name="del_expense" type="hidden" value="{{ expense.expense_id }}">
+            <button type="submit">{{ expense.expense|usd }}</button></form></td>
+            {% set ns.found = 1 %}
+            {% break %}
+        {% else %}
+            {% continue %}
+        {% endif %}
+    {% endfor %}
+    {% if ns.found == 0 %}<td></td>{% endif %}
+{% endfor %}
+<th>{{ total_expenses[category]|usd }}</th></tr>
+{% endfor %}
+"""
+
+Cell = namedtuple('Cell', ['category', 'day', 'expense_id', 'expense'])
+
+
+def grids(categories, month_days=31):
+    """Return (sparse, dense) month grids and totals."""
+
+    cat_list = [f'Category {i:02d}' for i in range(categories)]
+    sparse = {}
+    dense = {}
+    totals = {}
+    for i, category in enumerate(cat_list):
+        cells = [
+            Cell(category, day, i * 100 + day, day * 1.5)
+            for day in range(1, month_days + 1)
+        ]
+        sparse[category] = cells
+        dense[category] = list(cells)
+        totals[category] = sum(cell.expense for cell in cells)
+    return cat_list, sparse, dense, totals
+
+
+def timeit(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--categories', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args(argv)
+
+    # Import the application with a throwaway database
+    os.environ.setdefault(
+        'DATABASE_URL',
+        'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db'),
+    )
+    from app import app
+    from helpers import month_calendar, months
+
+    cat_list, sparse, dense, totals = grids(args.categories)
+    legacy = app.jinja_env.from_string(LEGACY_TABLE)
+    index = app.jinja_env.get_template('index.html')
+
+    with app.test_request_context('/'):
+        legacy_time = timeit(
+            lambda: legacy.render(
+                cat_list=cat_list,
+                month_expenses=sparse,
+                total_expenses=totals,
+                month_days=31,
+            ),
+            args.repeat,
+        )
+        index_time = timeit(
+            lambda: index.render(
+                months=months,
+                month_no=1,
+                month_calendar=month_calendar(2024, 1),
+                year=2024,
+                years=[2024],
+                month_expenses=dense,
+                total_expenses=totals,
+                cat_list=cat_list,
+            ),
+            args.repeat,
+        )
+
+    print(f'{args.categories} categories x 31 days')
+    print(f'previous table only : {legacy_time * 1000:8.2f} ms')
+    print(f'index.html (whole)  : {index_time * 1000:8.2f} ms')
+
+
+if __name__ == '__main__':
+    main()
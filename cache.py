@@ -0,0 +1,108 @@
+"""In-process caches shared by the routes."""
+
+import threading
+import time
+
+from collections import OrderedDict
+
+from metrics import Counter, Gauge
+
+# Caches reported in metrics, by name
+_caches = {}
+
+
+class LRUCache:
+    """Thread-safe least recently used cache with a size cap.
+
+    Entries are evicted when there are more than 'max_entries' of them
+    or when their total size is greater than 'max_bytes', and expire
+    'ttl' seconds after being stored (if given). Caches with a 'name'
+    are reported in metrics.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None, ttl=None, name=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._expires = {}
+        self._lock = threading.Lock()
+        if name is not None:
+            _caches[name] = self
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return cached value and mark it as recently used."""
+
+        with self._lock:
+            try:
+                value, _ = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if self.ttl is not None and self._expires[key] < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=0):
+        """Store value of given size, evicting least recently used entries."""
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size)
+            if self.ttl is not None:
+                self._expires[key] = time.monotonic() + self.ttl
+            self.size += size
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or (self.max_bytes is not None and self.size > self.max_bytes)
+            ):
+                self._remove(next(iter(self._entries)))
+
+    def discard(self, predicate):
+        """Remove all entries whose key matches 'predicate'."""
+
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._expires.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        # Caller holds the lock
+        self.size -= self._entries.pop(key)[1]
+        self._expires.pop(key, None)
+
+
+cache_hits = Counter(
+    'cache_hits_total',
+    'Lookups answered from an in-process cache.',
+    labels=('cache',),
+    function=lambda: {(name,): cache.hits for name, cache in _caches.items()},
+)
+cache_misses = Counter(
+    'cache_misses_total',
+    'Lookups not found in an in-process cache.',
+    labels=('cache',),
+    function=lambda: {(name,): cache.misses for name, cache in _caches.items()},
+)
+cache_entries = Gauge(
+    'cache_entries',
+    'Number of entries in an in-process cache.',
+    labels=('cache',),
+    function=lambda: {(name,): len(cache) for name, cache in _caches.items()},
+)
@@ -0,0 +1,225 @@
+"""Rendering of the pie chart with Matplotlib and mpld3.
+
+The charting stack (Matplotlib, seaborn, mpld3 and the numpy/pandas
+libraries they pull in) is imported on first use, so processes which
+never render a chart don't pay for it at startup.
+"""
+
+import concurrent.futures
+import hashlib
+import importlib
+import multiprocessing
+import threading
+import time
+
+from cache import LRUCache
+from config import Config
+from metrics import Counter, Gauge, Summary
+
+# Rendered charts by (user_id, year, mobile, data fingerprint)
+chart_cache = LRUCache(
+    max_entries=Config.CHART_CACHE_ENTRIES,
+    max_bytes=Config.CHART_CACHE_BYTES,
+    name='charts',
+)
+
+
+def preload_charts():
+    """Import the charting stack now (e.g. when a worker starts)."""
+
+    importlib.import_module('matplotlib.figure')
+    importlib.import_module('mpld3')
+    importlib.import_module('seaborn')
+
+
+def fingerprint(plot_data):
+    """Return digest identifying the data of a chart."""
+
+    items = sorted((str(key), str(value)) for key, value in plot_data.items())
+    return hashlib.sha1(repr(items).encode()).hexdigest()
+
+
+def render_pie(plot_data, mobile):
+    """Return html of the pie chart of expenses per category."""
+
+    # Import the charting stack on first use (cached in sys.modules later)
+    import mpld3
+    import seaborn as sns
+    from matplotlib.figure import Figure
+
+    if mobile:
+        figsize = (4.6, 4.6)
+        textprops = {'fontsize': 12, 'horizontalalignment': 'center'}
+    else:
+        figsize = (10, 10)
+        textprops = {'fontsize': 16, 'horizontalalignment': 'center'}
+
+    # When using Matplotlib in a web server it is strongly recommended
+    # to not use pyplot
+    # https://matplotlib.org/stable/gallery/user_interfaces/web_application_server_sgskip.html
+    fig = Figure(figsize=figsize, dpi=72, layout='constrained')
+    ax = fig.subplots()
+
+    # Draw a pie chart
+    _, labels, percentages = ax.pie(
+        plot_data.values(),
+        colors=sns.color_palette('crest'),
+        labels=plot_data.keys(),
+        autopct='%.2f%%',
+        pctdistance=0.6,
+        labeldistance=0.6,
+        wedgeprops={'linewidth': 2.0, 'edgecolor': 'white'},
+        textprops=textprops,
+    )
+
+    # Adjust labels' position
+    for label, percentage in zip(labels, percentages):
+        label.set_y(label.get_position()[1] + 0.1)
+        percentage.set_y(percentage.get_position()[1] - 0.05)
+
+    # Embed the chart into html
+    return mpld3.fig_to_html(fig)
+
+
+def _render_job(plot_data, mobile):
+    """Render chart in a pool worker, return html and rendering time."""
+
+    start = time.perf_counter()
+    html = render_pie(plot_data, mobile)
+    return html, time.perf_counter() - start
+
+
+class ChartUnavailable(Exception):
+    """Chart couldn't be rendered by the pool."""
+
+
+class ChartQueueFull(ChartUnavailable):
+    """Too many charts are waiting to be rendered."""
+
+
+class ChartTimeout(ChartUnavailable):
+    """Chart wasn't rendered in time."""
+
+
+class RenderPool:
+    """Pool of processes rendering charts outside of the web workers.
+
+    At most 'workers' charts are rendered at once and 'max_queue' wait
+    for a free worker; further requests are rejected right away
+    (ChartQueueFull) instead of piling up. A caller waits at most
+    'timeout' seconds for its chart (ChartTimeout).
+    """
+
+    def __init__(self, workers, max_queue, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self.pending = 0
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self):
+        # Processes are started on first use, with 'spawn' so they don't
+        # inherit database connections and locks of the web worker
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=preload_charts,
+                )
+            return self._executor
+
+    def _done(self, future):
+        with self._lock:
+            self.pending -= 1
+        self._slots.release()
+        if not future.cancelled() and future.exception() is None:
+            render_seconds.observe(future.result()[1])
+
+    def render(self, plot_data, mobile):
+        """Return html of the chart rendered by a pool worker."""
+
+        if not self._slots.acquire(blocking=False):
+            chart_rejections.inc(reason='queue_full')
+            raise ChartQueueFull()
+        with self._lock:
+            self.pending += 1
+
+        try:
+            future = self._get_executor().submit(
+                _render_job, dict(plot_data), mobile
+            )
+        except Exception:
+            with self._lock:
+                self.pending -= 1
+            self._slots.release()
+            raise
+
+        # The slot is released when the job ends, even after a timeout
+        future.add_done_callback(self._done)
+        try:
+            html, _ = future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            chart_rejections.inc(reason='timeout')
+            raise ChartTimeout()
+        return html
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+render_seconds = Summary(
+    'chart_render_seconds', 'Time spent rendering pie charts.'
+)
+chart_rejections = Counter(
+    'chart_rejections_total',
+    'Charts not rendered because the pool was busy or too slow.',
+    labels=('reason',),
+)
+chart_queue_depth = Gauge(
+    'chart_queue_depth',
+    'Charts being rendered or waiting for a pool worker.',
+    function=lambda: render_pool.pending if render_pool is not None else 0,
+)
+
+
+# Render charts in separate processes if configured, in the web worker
+# otherwise
+if Config.CHART_WORKERS > 0:
+    render_pool = RenderPool(
+        Config.CHART_WORKERS, Config.CHART_QUEUE_SIZE, Config.CHART_TIMEOUT
+    )
+else:
+    render_pool = None
+
+
+def get_pie(user_id, year, plot_data, mobile):
+    """Return html of the pie chart, rendering it only if not cached.
+
+    Raise ChartUnavailable if the render pool is busy or too slow.
+    """
+
+    key = (user_id, str(year), mobile, fingerprint(plot_data))
+    html = chart_cache.get(key)
+    if html is None:
+        if render_pool is not None:
+            html = render_pool.render(plot_data, mobile)
+        else:
+            start = time.perf_counter()
+            html = render_pie(plot_data, mobile)
+            render_seconds.observe(time.perf_counter() - start)
+        chart_cache.set(key, html, size=len(html))
+    return html
+
+
+def invalidate_charts(user_id, year=None):
+    """Forget cached charts of the user (for one year or all years)."""
+
+    chart_cache.discard(
+        lambda key: key[0] == user_id and (year is None or key[1] == str(year))
+    )
@@ -2,11 +2,72 @@ import os
 
 class Config:
     # https://blog.pythonanywhere.com/121/
-    SQLALCHEMY_DATABASE_URI = 'mysql+mysqlconnector://{username}:{password}@{hostname}/{databasename}'.format(
+    # DATABASE_URL overrides the MySQL database (e.g. sqlite:///budget.db)
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'mysql+mysqlconnector://{username}:{password}@{hostname}/{databasename}'.format(
         username=os.environ.get("DB_USERNAME", None),
         password=os.environ.get("DB_PASSWORD", None),
         hostname=os.environ.get("DB_HOSTNAME", None),
         databasename=os.environ.get("DB_NAME", None),
     )
-    SQLALCHEMY_POOL_RECYCLE = 299
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Connection pool: connections kept open, extra connections opened
+    # under load, seconds to wait for a free connection, seconds after
+    # which a connection is replaced (MySQL on PythonAnywhere closes idle
+    # connections after 300 s) and a liveness check on every checkout. The
+    # check is off by default: it costs a round trip per checkout (several
+    # per page) and the recycling already replaces idle connections.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 299)),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '0') not in ('', '0'),
+    }
+
+    # Longest time in seconds a statement may run (0 disables the limit)
+    DB_STATEMENT_TIMEOUT = float(os.environ.get('DB_STATEMENT_TIMEOUT', 0))
+
+    # Database of the async engine of asgi.py, by default the database
+    # above with its async driver (aiomysql or aiosqlite)
+    ASYNC_DATABASE_URL = os.environ.get('ASYNC_DATABASE_URL')
+
+    # SQLite production mode (ignored for MySQL): WAL journal, page cache
+    # and memory-mapped I/O in MB, seconds to wait for a lock, read-only
+    # connections (DB_POOL_SIZE of them) for reads and a single writer
+    SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION', '0') not in ('', '0')
+    SQLITE_CACHE_MB = int(os.environ.get('SQLITE_CACHE_MB', 64))
+    SQLITE_MMAP_MB = int(os.environ.get('SQLITE_MMAP_MB', 256))
+    SQLITE_BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))
+
+    # Where sessions are kept: 'filesystem' (Flask-Session), 'sqlite' or 'redis'
+    SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'filesystem')
+    SESSION_SQLITE_PATH = os.environ.get('SESSION_SQLITE_PATH', 'sessions.db')
+    SESSION_REDIS_URL = os.environ.get('SESSION_REDIS_URL', 'redis://localhost:6379/0')
+    # Seconds after the last write when a stored session expires
+    SESSION_LIFETIME = int(os.environ.get('SESSION_LIFETIME', 7 * 24 * 3600))
+
+    # Cache of categories and years lists of users (per process),
+    # entries expire after VALUES_CACHE_TTL seconds
+    VALUES_CACHE_ENTRIES = int(os.environ.get('VALUES_CACHE_ENTRIES', 4096))
+    VALUES_CACHE_TTL = float(os.environ.get('VALUES_CACHE_TTL', 30))
+
+    # Render the pie chart on the server ('mpld3') or in the browser ('client')
+    CHART_RENDERER = os.environ.get('CHART_RENDERER', 'mpld3')
+
+    # Import Matplotlib, seaborn and mpld3 when the application starts
+    # instead of on the first chart (for workers dedicated to charts)
+    CHART_PRELOAD = os.environ.get('CHART_PRELOAD', '') not in ('', '0')
+
+    # Render pie charts in a pool of processes (0 renders in the web worker),
+    # with the number of charts allowed to wait and the time limit in seconds
+    CHART_WORKERS = int(os.environ.get('CHART_WORKERS', 0))
+    CHART_QUEUE_SIZE = int(os.environ.get('CHART_QUEUE_SIZE', 16))
+    CHART_TIMEOUT = float(os.environ.get('CHART_TIMEOUT', 10))
+
+    # Cache of rendered pie charts (per process)
+    CHART_CACHE_ENTRIES = int(os.environ.get('CHART_CACHE_ENTRIES', 256))
+    CHART_CACHE_BYTES = int(os.environ.get('CHART_CACHE_BYTES', 64 * 1024 * 1024))
+
+    # Log requests taking at least this many seconds (0 disables the log)
+    SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', 0))
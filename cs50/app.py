@@ -1,15 +1,29 @@
 import datetime
+import math
 import mpld3
+import os
 import re
 import seaborn as sns
+import sys
 
-from cs50 import SQL
 from flask import Flask, redirect, render_template, request, session
 from flask_session import Session
 from matplotlib.figure import Figure
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from helpers import get_values, login_required, sorry, usd, months
+from helpers import login_required, month_calendar, sorry, usd, months
+
+# Queries are shared with the main application (the parent directory)
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import migrate
+
+from config import Config
+from database import SQLITE_WRITER_POOL, sqlite_production
+from repository import Repository
+from rollups import MAX_EXPENSE
 
 # Configure application
 app = Flask(__name__)
@@ -28,8 +42,25 @@ app.config['SESSION_PERMANENT'] = False
 app.config['SESSION_TYPE'] = 'filesystem'
 Session(app)
 
-# Configure CS50 Library to use SQLite database
-db = SQL('sqlite:///budget.db')
+# Configure SQLAlchemy to use SQLite database, with the schema
+# of the main application (indexes, rollups and data versions).
+# With SQLITE_PRODUCTION=1 the database is used in WAL mode by one
+# writer and a pool of read-only connections, so adding expenses
+# doesn't block the readers of the month view.
+if Config.SQLITE_PRODUCTION:
+    engine = create_engine('sqlite:///budget.db', **SQLITE_WRITER_POOL)
+    migrate.upgrade(engine)
+    repository = Repository(engine, sqlite_production(
+        engine,
+        {'pool_size': Config.SQLALCHEMY_ENGINE_OPTIONS['pool_size']},
+        Config.SQLITE_CACHE_MB,
+        Config.SQLITE_MMAP_MB,
+        Config.SQLITE_BUSY_TIMEOUT,
+    ))
+else:
+    engine = create_engine('sqlite:///budget.db')
+    migrate.upgrade(engine)
+    repository = Repository(engine)
 
 
 @app.route('/')
@@ -39,82 +70,45 @@ def index():
 
     # Get list of years of expenses from database and remember them
     # to share across all templates
-    session['years'] = get_values(
-        db, 'expenses', 'year', session['user_id'], distinct=True
-    )
+    session['years'] = repository.expense_years(session['user_id'])
 
     # Determine the year for which expenses will be displayed
     if request.args.get('disp_year'):
-        session['year'] = request.args.get('disp_year')
+        try:
+            session['year'] = int(request.args.get('disp_year'))
+        except ValueError:
+            return sorry('Must provide correct year.')
     else:
         session['year'] = datetime.date.today().year
 
     # Determine the month for which expenses will be displayed
     # Based on user request or defaulting to current month
     if request.args.get('months_radio'):
-        month_no = months.index(request.args.get('months_radio')) + 1
+        try:
+            month_no = months.index(request.args.get('months_radio')) + 1
+        except ValueError:
+            return sorry('Must provide correct month.')
     else:
         month_no = datetime.date.today().month
 
     # Query database to get categories of the logged-in user
-    cat_list = get_values(db, 'categories', 'category', session['user_id'])
+    cat_list = repository.category_names(session['user_id'])
 
     # Query database to find the sum of expenses per category and day
-    # for the selected month
-    month_expenses = {}
-    total_expenses = {}
-    for category in cat_list:
-        expenses = db.execute(
-            """
-            SELECT expenses.id AS expense_id, year, month, day,
-                   SUM(expense) AS expense
-              FROM expenses, categories
-             WHERE expenses.category_id = categories.id
-               AND expenses.user_id = categories.user_id
-               AND expenses.user_id = ?
-               AND category = ?
-               AND month = ?
-               AND year = ?
-             GROUP BY year, month, day
-            """,
-            session['user_id'],
-            category,
-            month_no,
-            session['year'],
-        )
-
-        # Add sorted list of dicts with all expenses per day
-        # to the dictionary with categories
-        month_expenses[category] = expenses
-
-        # Query database to calculate total expenses per category
-        # for the selected month
-        total = db.execute(
-            """
-            SELECT SUM(expense) AS sum
-              FROM expenses, categories
-             WHERE expenses.category_id = categories.id
-               AND expenses.user_id = categories.user_id
-               AND expenses.user_id = ?
-               AND category = ?
-               AND month = ?
-               AND year = ?
-            """,
-            session['user_id'],
-            category,
-            month_no,
-            session['year'],
-        )
-
-        # Add total sum of expenses to the dict by a category
-        # (only one dict of sums in 'total')
-        total_expenses[category] = total[0]['sum']
+    # for the selected month, together with totals per category
+    month_expenses, total_expenses = repository.month_grid(
+        session['user_id'],
+        session['year'],
+        month_no,
+        cat_list,
+    )
 
     # Render the template with retrieved data
     return render_template(
         'index.html',
         months=months,
         month_no=month_no,
+        month_calendar=month_calendar(session['year'], month_no),
         year=session['year'],
         years=session['years'],
         month_expenses=month_expenses,
@@ -132,46 +126,45 @@ def add_expense():
     if request.method == 'POST':
         # Retrive year, month, day if 'date' field is filled in
         try:
-            year, month_no, day = request.form.get('date').split('-')
-        except ValueError:
+            year, month_no, day = [
+                int(part) for part in request.form.get('date').split('-')
+            ]
+            datetime.date(year, month_no, day)
+        except (AttributeError, ValueError):
             # Error handling for invalid date format
             return sorry('Must provide date.')
 
-        # Check if user selected category in 'category' field
-        if request.form.get('category_id') == '0':
+        # Check if user selected one of their categories in 'category' field
+        category_ids = {
+            str(category.id)
+            for category in repository.categories(session['user_id'])
+        }
+        if request.form.get('category_id') not in category_ids:
             return sorry('Must provide category.')
 
-        # Check if the 'expense' field is empty
-        if not request.form.get('expense'):
+        # Check if the 'expense' field is empty or not a positive number
+        try:
+            expense = float(request.form.get('expense'))
+        except (TypeError, ValueError):
+            return sorry('Must provide amount.')
+        if not math.isfinite(expense) or not 0 < expense <= MAX_EXPENSE:
             return sorry('Must provide amount.')
 
         # Insert the new expense into the 'expenses' table
-        db.execute(
-            """
-            INSERT INTO expenses (user_id, year, month, day, category_id, expense)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            session['user_id'],
-            year,
-            month_no,
-            day,
-            request.form.get('category_id'),
-            request.form.get('expense'),
-        )
+        repository.add_expenses(session['user_id'], [{
+            'user_id': session['user_id'],
+            'year': year,
+            'month': month_no,
+            'day': day,
+            'category_id': int(request.form.get('category_id')),
+            'expense': expense,
+        }])
         return redirect('/')
 
     # User reached route via GET
     else:
         # Query database to get id and categories of the logged-in user
-        cat_list = db.execute(
-            """
-            SELECT id, category
-              FROM categories
-             WHERE user_id = ?
-             ORDER BY category
-            """,
-            session['user_id'],
-        )
+        cat_list = repository.categories(session['user_id'])
         return render_template(
             'add_expense.html',
             cat_list=cat_list,
@@ -192,7 +185,7 @@ def categories():
             return sorry('Must provide category name.')
 
         # Query database to get categories of the logged-in user
-        cat_list = get_values(db, 'categories', 'category', session['user_id'])
+        cat_list = repository.category_names(session['user_id'])
 
         # Change categories' names to lowercase
         cat_list = [category.lower() for category in cat_list]
@@ -201,12 +194,15 @@ def categories():
         if request.form.get('category_name').lower() in cat_list:
             return sorry('Category name already exists.')
 
-        # Insert the new category into the 'categories' table
-        db.execute(
-            'INSERT INTO categories (category, user_id) VALUES(?, ?)',
-            request.form.get('category_name').title(),
-            session['user_id'],
-        )
+        # Insert the new category into the 'categories' table (the unique
+        # index rejects a category added in the meantime, which the
+        # cached list may not show yet)
+        try:
+            repository.add_category(
+                session['user_id'], request.form.get('category_name').title()
+            )
+        except IntegrityError:
+            return sorry('Category name already exists.')
 
         # Redirect user to category list
         return redirect('/categories')
@@ -216,12 +212,7 @@ def categories():
         return render_template(
             'categories.html',
             years=session['years'],
-            cat_list=get_values(
-                db,
-                'categories',
-                'category',
-                session['user_id'],
-            ),
+            cat_list=repository.category_names(session['user_id']),
         )
 
 
@@ -232,34 +223,10 @@ def delete_category():
 
     # User reached route via POST (as by submitting a form via POST)
     if request.method == 'POST':
-        # Query database to check if there are any expenses in category
-        expenses_in_category = db.execute(
-            """
-            SELECT id, category_id
-              FROM expenses
-             WHERE user_id = ?
-               AND category_id IN
-                   (SELECT id
-                      FROM categories
-                     WHERE user_id = ?
-                       AND category = ?)
-            """,
-            session['user_id'],
-            session['user_id'],
-            request.form.get('del_category'),
-        )
-
-        # If the category is empty, can be deleted
-        if not expenses_in_category:
-            db.execute(
-                """
-                DELETE FROM categories
-                 WHERE category = ?
-                   AND user_id = ?
-                """,
-                request.form.get('del_category'),
-                session['user_id'],
-            )
+        # The category can be deleted only if it is empty
+        if repository.delete_category(
+            session['user_id'], request.form.get('del_category')
+        ):
             # Show all categories
             return redirect('/categories')
 
@@ -283,8 +250,8 @@ def delete_expense():
     if request.method == 'POST':
         # Request to remove the chosen expense in 'delete_expense.html'
         if request.form.get('del_chosen_expense'):
-            db.execute(
-                'DELETE FROM expenses WHERE id = ?',
+            repository.delete_expense(
+                session['user_id'],
                 request.form.get('del_chosen_expense'),
             )
             # Redirect user to home page
@@ -292,36 +259,14 @@ def delete_expense():
 
         # Request to remove the expense
         if request.form.get('del_expense'):
-            # Query database to find the expense info
-            expense_category_day = db.execute(
-                """
-                SELECT year, month, day, category_id, category
-                  FROM expenses
-                  JOIN categories
-                    ON expenses.category_id = categories.id
-                 WHERE expenses.user_id = ?
-                   AND expenses.id = ?
-                """,
+            # Query database to find the expense info and all expenses
+            # on this day
+            expense, expenses_list = repository.expense_day(
                 session['user_id'],
                 request.form.get('del_expense'),
             )
-
-            # Count all expenses on this day
-            expenses_list = db.execute(
-                """
-                SELECT id, expense FROM expenses
-                 WHERE user_id = ?
-                   AND year = ?
-                   AND month = ?
-                   AND day = ?
-                   AND category_id = ?
-                """,
-                session['user_id'],
-                expense_category_day[0]['year'],
-                expense_category_day[0]['month'],
-                expense_category_day[0]['day'],
-                expense_category_day[0]['category_id'],
-            )
+            if expense is None:
+                return redirect('/')
 
             # If there is more than one expense, redirect user to choose
             # which to delete
@@ -329,14 +274,14 @@ def delete_expense():
                 return render_template(
                     'delete_expense.html',
                     expenses_list=expenses_list,
-                    expense_category_day=expense_category_day,
+                    expense_category_day=[expense],
                     years=session['years'],
                 )
 
             # If only one expense, delete it
             else:
-                db.execute(
-                    'DELETE FROM expenses WHERE id = ?',
+                repository.delete_expense(
+                    session['user_id'],
                     request.form.get('del_expense'),
                 )
                 # Redirect user to home page
@@ -365,19 +310,16 @@ def login():
             return sorry('Must provide password.')
 
         # Query the database to get a username
-        user = db.execute(
-            'SELECT * FROM users WHERE username = ?',
-            request.form.get('username'),
-        )
+        user = repository.find_user(request.form.get('username'))
 
         # Check if the entered username already exists
-        if (len(user) != 1
-                or not check_password_hash(user[0]['hash'],
+        if (user is None
+                or not check_password_hash(user.hash,
                                            request.form.get('password'))):
             return sorry('Invalid username or password.')
 
         # Remember which user logged in
-        session['user_id'] = user[0]['id']
+        session['user_id'] = user.id
 
         # Redirect user to home page
         return redirect('/')
@@ -408,13 +350,9 @@ def register():
         if not request.form.get('username'):
             return sorry('Must provide username.')
 
-        # Query the database to get a list of existing usernames
-        usernames = db.execute('SELECT username FROM users')
-
         # Check if the entered username already exists in the database
-        for user in usernames:
-            if request.form.get('username') == user['username']:
-                return sorry('Username already exists.')
+        if repository.username_exists(request.form.get('username')):
+            return sorry('Username already exists.')
 
         # Check if the 'password' field is empty
         if not request.form.get('password'):
@@ -428,11 +366,11 @@ def register():
         hashed_password = generate_password_hash(request.form.get('password'))
 
         # Insert the username and hashed password into the 'users' table
-        db.execute(
-            'INSERT INTO users (username, hash) VALUES(?, ?)',
-            request.form.get('username'),
-            hashed_password,
-        )
+        # (the unique index rejects a username registered in the meantime)
+        try:
+            repository.create_user(request.form.get('username'), hashed_password)
+        except IntegrityError:
+            return sorry('Username already exists.')
 
         # Redirect user to the homepage after successful registration
         return redirect('/')
@@ -450,7 +388,7 @@ def rename_category():
 
     # User reached route via POST (as by submitting a form via POST)
     if request.method == 'POST':
-        cat_list = get_values(db, 'categories', 'category', session['user_id'])
+        cat_list = repository.category_names(session['user_id'])
 
         # Check if the 'old_name' field is empty or wrong
         if (not request.form.get('old_name')
@@ -462,16 +400,16 @@ def rename_category():
                 or request.form.get('new_name').title() in cat_list):
             return sorry('Must provide correct new category name.')
 
-        # Update the category name
-        db.execute(
-            """
-            UPDATE categories
-               SET category = ?
-             WHERE category = ?
-            """,
-            request.form.get('new_name').title(),
-            request.form.get('old_name').title(),
-        )
+        # Update the category name (the unique index rejects a name
+        # taken in the meantime)
+        try:
+            repository.rename_category(
+                session['user_id'],
+                request.form.get('old_name').title(),
+                request.form.get('new_name').title(),
+            )
+        except IntegrityError:
+            return sorry('Must provide correct new category name.')
 
         # Show all categories
         return redirect('/categories')
@@ -486,33 +424,11 @@ def rename_category():
 def structure():
     """Generate pie chart."""
 
-    # Query database to get categories of the logged-in user
-    cat_list = get_values(db, 'categories', 'category', session['user_id'])
+    # Year of the last month view (the current year by default)
+    year = session.get('year', datetime.date.today().year)
 
     # Query database to find the sum of expenses per each category
-    plot_data = {}
-    total = 0
-    for category in cat_list:
-        sums = db.execute(
-            """
-            SELECT SUM(expense) AS sum
-              FROM expenses, categories
-             WHERE expenses.category_id = categories.id
-               AND expenses.user_id = categories.user_id
-               AND expenses.user_id = ?
-               AND year = ?
-               AND category = ?
-            """,
-            session['user_id'],
-            session['year'],
-            category,
-        )
-
-        # Add sum of expenses to the dictionary by a category
-        # (only one dict of sums in list)
-        if sums[0]['sum']:
-            plot_data[category] = sums[0]['sum']
-            total += sums[0]['sum']
+    plot_data = repository.category_sums(session['user_id'], year)
 
     # Check if user is using a mobile browser
     browser = request.user_agent
@@ -554,5 +470,5 @@ def structure():
         'pie_chart.html',
         mpld3_plot=mpld3_plot,
         years=session['years'],
-        year=session['year'],
+        year=year,
     )
@@ -1,5 +1,8 @@
+import calendar
+
+from collections import namedtuple
 from flask import redirect, render_template, session
-from functools import wraps
+from functools import lru_cache, wraps
 
 months = [
     'January',
@@ -16,31 +19,22 @@ months = [
     'December',
 ]
 
+# Calendar of a month: number of days, weeks as lists of day numbers
+# (0 outside the month, Monday first) and weekday of every day (0 is Monday)
+MonthCalendar = namedtuple('MonthCalendar', ['days', 'weeks', 'weekdays'])
 
-def get_values(database, table, col, user_id, distinct=False):
-    """Return sorted list of values from 'col' column of database."""
 
-    # Check if user requested distinct values
-    if distinct:
-        column = f'DISTINCT({col})'
-    else:
-        column = col
+@lru_cache(maxsize=256)
+def month_calendar(year, month_no):
+    """Return MonthCalendar of the month (leap years included)."""
 
-    # Query database to get requested values of the logged-in user
-    rows = database.execute(
-            f"""
-            SELECT {column}
-              FROM {table}
-             WHERE user_id = ?
-            """,
-            user_id,
+    year, month_no = int(year), int(month_no)
+    first_weekday, days = calendar.monthrange(year, month_no)
+    weeks = tuple(
+        tuple(week) for week in calendar.monthcalendar(year, month_no)
     )
-
-    # Ensure the list of values is sorted
-    lst = []
-    for value in rows:
-        lst.append(value[col])
-    return sorted(lst)
+    weekdays = tuple((first_weekday + day) % 7 for day in range(days))
+    return MonthCalendar(days, weeks, weekdays)
 
 
 def login_required(f):
@@ -0,0 +1,207 @@
+"""Connection pools, statement timeouts and SQLite production mode.
+
+The pool itself is configured with SQLALCHEMY_ENGINE_OPTIONS (see
+config.py). Connections kept open, checked out and opened beyond the
+pool size are read from the pool when '/metrics' is scraped. Time spent
+waiting for a connection is measured by connect(), which every query of
+Repository goes through.
+
+In SQLite production mode the database is used in WAL mode by one
+writer connection and a pool of read-only connections, so reads never
+wait for a write to finish (see sqlite_production()).
+"""
+
+import contextlib
+import time
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+
+from metrics import Counter, Gauge, Summary
+
+# Engines whose pools are reported, by name
+_engines = {}
+
+
+def _pool_stat(name):
+    """Return function reading the statistic of every watched pool.
+
+    Pools without the statistic (e.g. of in-memory SQLite) report 0.
+    """
+
+    def read():
+        values = {}
+        for pool_name, engine in list(_engines.items()):
+            method = getattr(engine.pool, name, None)
+            values[(pool_name,)] = method() if method is not None else 0
+        return values
+    return read
+
+
+pool_size = Gauge(
+    'db_pool_size', 'Connections kept open by the pool.',
+    labels=('pool',), function=_pool_stat('size'),
+)
+pool_checked_out = Gauge(
+    'db_pool_checked_out', 'Connections in use.',
+    labels=('pool',), function=_pool_stat('checkedout'),
+)
+pool_overflow = Gauge(
+    'db_pool_overflow',
+    'Connections opened beyond the pool size (negative while the pool '
+    'is not full yet).',
+    labels=('pool',), function=_pool_stat('overflow'),
+)
+pool_wait_seconds = Summary(
+    'db_pool_wait_seconds',
+    'Time spent getting a connection from the pool (with the pre-ping, '
+    'if enabled).',
+)
+pool_timeouts = Counter(
+    'db_pool_timeouts_total',
+    'Requests for a connection which timed out (pool exhausted).',
+)
+
+
+def watch_pool(engine, name='main'):
+    """Report the pool of the engine at '/metrics' under the name."""
+
+    _engines[name] = engine
+
+
+@contextlib.contextmanager
+def connect(engine, begin=False):
+    """Check out a connection of the engine, measuring the wait.
+
+    With 'begin', the block runs in a transaction which is committed at
+    the end (rolled back on an exception), like engine.begin().
+    """
+
+    start = time.perf_counter()
+    try:
+        conn = engine.connect()
+    except PoolTimeout:
+        pool_timeouts.inc()
+        raise
+    pool_wait_seconds.observe(time.perf_counter() - start)
+    with conn:
+        if begin:
+            with conn.begin():
+                yield conn
+        else:
+            yield conn
+
+
+def set_statement_timeout(engine, seconds):
+    """Abort statements of the engine running longer than 'seconds'.
+
+    MySQL limits SELECT statements (max_execution_time), MariaDB every
+    statement (max_statement_time). SQLite has no such setting, so a
+    progress handler interrupts statements which run past their deadline
+    before returning the first row. 0 disables the limit.
+    """
+
+    if not seconds:
+        return
+
+    if engine.dialect.name == 'mysql':
+        @event.listens_for(engine, 'connect')
+        def limit_statements(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            if getattr(engine.dialect, 'is_mariadb', False):
+                cursor.execute(f'SET SESSION max_statement_time = {seconds:f}')
+            else:
+                cursor.execute(
+                    f'SET SESSION max_execution_time = {int(seconds * 1000)}'
+                )
+            cursor.close()
+
+    elif engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, 'connect')
+        def limit_statements(dbapi_connection, connection_record):
+            info = connection_record.info
+
+            def past_deadline():
+                deadline = info.get('statement_deadline')
+                return deadline is not None and time.monotonic() > deadline
+
+            # Called every 10000 virtual machine instructions
+            dbapi_connection.set_progress_handler(past_deadline, 10000)
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def start_deadline(conn, cursor, statement, parameters, context,
+                           executemany):
+            conn.info['statement_deadline'] = time.monotonic() + seconds
+
+        # Rows are fetched at the pace of the caller (e.g. a streamed
+        # export), so only the time to the first row is limited
+        @event.listens_for(engine, 'after_cursor_execute')
+        def clear_deadline(conn, cursor, statement, parameters, context,
+                           executemany):
+            conn.info.pop('statement_deadline', None)
+
+
+# Pool of the writer of SQLite in production mode: a second writer
+# would only wait for the lock of the database
+SQLITE_WRITER_POOL = {'pool_size': 1, 'max_overflow': 0}
+
+
+def _tune_sqlite(dbapi_connection, cache_mb, mmap_mb, busy_timeout):
+    cursor = dbapi_connection.cursor()
+    # Safe in WAL mode: a crash can lose the last commits, never corrupt
+    cursor.execute('PRAGMA synchronous = NORMAL')
+    # Negative size is in KiB
+    cursor.execute(f'PRAGMA cache_size = {-cache_mb * 1024:d}')
+    cursor.execute(f'PRAGMA mmap_size = {mmap_mb * 1024 * 1024:d}')
+    cursor.execute(f'PRAGMA busy_timeout = {int(busy_timeout * 1000):d}')
+    return cursor
+
+
+def sqlite_production(engine, reader_options, cache_mb=64, mmap_mb=256,
+                      busy_timeout=5):
+    """Switch the SQLite database of the engine to WAL and tune the engine
+    as its writer. Return engine of read-only connections to the database.
+
+    The engine should be created with SQLITE_WRITER_POOL, so writes are
+    serialised by its pool instead of failing with 'database is locked'.
+    Write transactions start with BEGIN IMMEDIATE, so a transaction of
+    another process can't make them fail half-way. 'reader_options' are
+    the create_engine() options (pool size...) of the readers.
+    """
+
+    @event.listens_for(engine, 'connect')
+    def tune_writer(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN (see below) instead of the driver
+        dbapi_connection.isolation_level = None
+        cursor = _tune_sqlite(dbapi_connection, cache_mb, mmap_mb, busy_timeout)
+        cursor.execute('PRAGMA journal_mode = WAL')
+        cursor.close()
+
+    @event.listens_for(engine, 'begin')
+    def begin_immediate(conn):
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+    # Reopen connections made before (e.g. by migrations) with the
+    # settings. WAL is kept in the database file, readers open it in
+    # WAL mode.
+    engine.dispose()
+    with engine.connect():
+        pass
+
+    reader = create_engine(engine.url, **reader_options)
+    sqlite_reader(reader, cache_mb, mmap_mb, busy_timeout)
+    return reader
+
+
+def sqlite_reader(engine, cache_mb=64, mmap_mb=256, busy_timeout=5):
+    """Tune connections of the engine as read-only readers of a database
+    in WAL mode (see sqlite_production()).
+
+    Also used for the async engine of asgi.py, through its sync_engine.
+    """
+
+    @event.listens_for(engine, 'connect')
+    def tune_reader(dbapi_connection, connection_record):
+        cursor = _tune_sqlite(dbapi_connection, cache_mb, mmap_mb, busy_timeout)
+        cursor.execute('PRAGMA query_only = ON')
+        cursor.close()
@@ -0,0 +1,94 @@
+"""Streaming export of expenses as CSV or NDJSON.
+
+Rows are fetched with a server-side cursor in batches and formatted
+one by one, so exporting years of history never loads it all in memory.
+CSV files have the same columns as the files accepted by importer.py.
+"""
+
+import csv
+import datetime
+import io
+import json
+
+from sqlalchemy import bindparam, text
+
+from database import connect
+
+# Rows fetched from the cursor at once
+BATCH_SIZE = 1000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def export_rows(engine, user_id, start=None, end=None, categories=None):
+    """Yield (date, category, amount) of expenses of the user, by date.
+
+    'start' and 'end' are inclusive datetime.date bounds, 'categories'
+    an optional list of category names.
+    """
+
+    start = start or datetime.date(datetime.MINYEAR, 1, 1)
+    end = end or datetime.date(datetime.MAXYEAR, 12, 31)
+    params = {
+        'user_id': user_id,
+        'start_year': start.year,
+        'end_year': end.year,
+        'start': start.year * 10000 + start.month * 100 + start.day,
+        'end': end.year * 10000 + end.month * 100 + end.day,
+    }
+
+    # The year range can use the index on expenses, the exact dates
+    # are checked on the remaining rows
+    query = """
+        SELECT year, month, day, category, expense
+          FROM expenses
+          JOIN categories
+            ON expenses.category_id = categories.id
+           AND expenses.user_id = categories.user_id
+         WHERE expenses.user_id = :user_id
+           AND year BETWEEN :start_year AND :end_year
+           AND year * 10000 + month * 100 + day BETWEEN :start AND :end
+    """
+    if categories:
+        query += " AND category IN :categories"
+        params['categories'] = list(categories)
+    query += " ORDER BY year, month, day"
+
+    statement = text(query)
+    if categories:
+        statement = statement.bindparams(bindparam('categories', expanding=True))
+
+    with connect(engine) as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=BATCH_SIZE
+        ).execute(statement, params)
+        for year, month, day, category, expense in result:
+            yield f'{year:04d}-{month:02d}-{day:02d}', category, expense
+
+
+def to_csv(rows):
+    """Yield lines of CSV file with header."""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['date', 'category', 'amount'])
+    for date, category, amount in rows:
+        writer.writerow([date, category, f'{amount:.2f}'])
+        # Flush every row to keep the buffer small
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def to_ndjson(rows):
+    """Yield lines of newline-delimited JSON objects."""
+
+    for date, category, amount in rows:
+        yield json.dumps(
+            {'date': date, 'category': category, 'amount': float(amount)},
+            separators=(',', ':'),
+        ) + '\n'
@@ -1,6 +1,9 @@
-from flask import redirect, render_template, session
-from functools import wraps
-from sqlalchemy import text
+import calendar
+import datetime
+
+from collections import namedtuple
+from flask import jsonify, redirect, render_template, session
+from functools import lru_cache, wraps
 
 months = [
     'January',
@@ -17,31 +20,48 @@ months = [
     'December',
 ]
 
+# Calendar of a month: number of days, weeks as lists of day numbers
+# (0 outside the month, Monday first) and weekday of every day (0 is Monday)
+MonthCalendar = namedtuple('MonthCalendar', ['days', 'weeks', 'weekdays'])
+
+
+@lru_cache(maxsize=256)
+def month_calendar(year, month_no):
+    """Return MonthCalendar of the month (leap years included)."""
+
+    year, month_no = int(year), int(month_no)
+    first_weekday, days = calendar.monthrange(year, month_no)
+    weeks = tuple(
+        tuple(week) for week in calendar.monthcalendar(year, month_no)
+    )
+    weekdays = tuple((first_weekday + day) % 7 for day in range(days))
+    return MonthCalendar(days, weeks, weekdays)
 
-def get_values(database, table, col, user_id, distinct=False):
-    """Return sorted list of values from 'col' column of database."""
 
-    # Check if user requested distinct values
-    if distinct:
-        column = f'DISTINCT({col})'
-    else:
-        column = col
+def get_view():
+    """Return year and month displayed to the user.
 
-    # Query database to get requested values of the logged-in user
-    rows = database.session.execute(
-        text(f"""
-            SELECT {column}
-              FROM {table}
-             WHERE user_id = :user_id
-        """),
-        {'user_id': user_id}
-    ).fetchall()
+    The view is remembered in the session by index(), it defaults
+    to the current month.
+    """
+
+    view = session.get('view')
+    if view is None:
+        today = datetime.date.today()
+        return today.year, today.month
+    return view['year'], view['month']
 
-    # Ensure the list of values is sorted
-    lst = []
-    for value in rows:
-        lst.append(value[0])
-    return sorted(lst)
+
+def api_login_required(f):
+    """Decorator for login requirement of the JSON API (401 instead of
+    redirect)."""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('user_id') is None:
+            return jsonify({'error': 'Login required.'}), 401
+        return f(*args, **kwargs)
+    return decorated_function
 
 
 def login_required(f):
@@ -58,6 +78,10 @@ def login_required(f):
     return decorated_function
 
 
+def api_error(message, code=400):
+    return jsonify({'error': message}), code
+
+
 def sorry(message, code=400):
     return render_template('sorry.html', message=message), code
 
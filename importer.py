@@ -0,0 +1,303 @@
+"""Bulk import of expenses from CSV or OFX files.
+
+Files are read as a stream and inserted in chunks, one transaction per
+chunk, so memory use doesn't depend on the size of the file. Lines which
+can't be read (not UTF-8, broken CSV) are rejected like invalid rows, so
+a file is never left imported half-way without a count.
+
+CSV files need a header with 'date' (YYYY-MM-DD), 'category' and
+'amount' (or 'expense') columns. OFX files have no categories, all their
+transactions go to one category given by the user.
+
+Usage:
+    python importer.py --user-id 1 expenses.csv
+    python importer.py --user-id 1 --category Bank statement.ofx
+"""
+
+import argparse
+import csv
+import datetime
+import math
+import re
+import time
+
+from collections import defaultdict, namedtuple
+
+from sqlalchemy import create_engine, text
+
+from rollups import MAX_EXPENSE, add_to_rollups
+from versions import bump_data_version
+
+CHUNK_SIZE = 5000
+
+# Number of rejected rows reported back with the reason
+MAX_ERRORS = 20
+
+ImportResult = namedtuple(
+    'ImportResult', ['imported', 'rejected', 'errors', 'seconds']
+)
+
+# Yielded by the readers instead of a row for a line they can't read
+Unreadable = namedtuple('Unreadable', ['line', 'error'])
+
+# Streams are decoded with errors='replace', undecodable bytes become
+# this character
+REPLACEMENT_CHARACTER = '\ufffd'
+
+_OFX_TAG = re.compile(r'<(/?)([A-Z0-9.]+)>([^<\r\n]*)')
+
+
+def read_csv(stream):
+    """Yield (line number, date, category, amount) of rows of a CSV file,
+    or Unreadable for rows the csv module rejects."""
+
+    reader = csv.DictReader(stream)
+    fields = {name.strip().lower(): name for name in reader.fieldnames or []}
+    amount = fields.get('amount', fields.get('expense'))
+    if 'date' not in fields or 'category' not in fields or amount is None:
+        raise ValueError(
+            "CSV file must have 'date', 'category' and 'amount' columns."
+        )
+    while True:
+        # The reader goes on with the next line after an error
+        try:
+            row = next(reader)
+        except StopIteration:
+            return
+        except csv.Error as error:
+            # The line of the error isn't counted yet
+            yield Unreadable(reader.line_num + 1, error)
+            continue
+        yield (
+            reader.line_num,
+            row[fields['date']],
+            row[fields['category']],
+            row[amount],
+        )
+
+
+def read_ofx(stream, category):
+    """Yield (line number, date, category, amount) of OFX transactions.
+
+    Works with both SGML (OFX 1.x) and XML (OFX 2.x) files. Debits are
+    negative in OFX and imported as positive expenses. Credits (income,
+    refunds) are not expenses and are skipped.
+    """
+
+    transaction = None
+    for line_num, line in enumerate(stream, start=1):
+        for closing, tag, value in _OFX_TAG.findall(line):
+            if tag == 'STMTTRN':
+                if closing and transaction is not None:
+                    amount = transaction.get('TRNAMT', '')
+                    is_debit = amount.startswith('-')
+                    # A missing amount is reported as an invalid row
+                    if amount and (
+                        not is_debit or transaction.get('TRNTYPE') == 'CREDIT'
+                    ):
+                        transaction = None
+                        continue
+                    yield (
+                        transaction['line'],
+                        transaction.get('DTPOSTED', ''),
+                        category,
+                        amount[1:] if is_debit else amount,
+                    )
+                    transaction = None
+                elif not closing:
+                    transaction = {'line': line_num}
+            elif transaction is not None and not closing:
+                transaction[tag] = value.strip()
+
+
+def _parse(date, amount):
+    """Return (year, month, day, amount) or raise ValueError."""
+
+    date = date.strip()
+    if re.fullmatch(r'\d{8}.*', date):
+        # OFX dates: YYYYMMDD[HHMMSS...]
+        date = f'{date[:4]}-{date[4:6]}-{date[6:8]}'
+    day = datetime.date.fromisoformat(date)
+    amount = float(amount)
+    if not math.isfinite(amount) or amount <= 0:
+        raise ValueError(f'amount must be positive, not {amount}')
+    if amount > MAX_EXPENSE:
+        raise ValueError(f'amount must be at most {MAX_EXPENSE:,.2f}')
+    return day.year, day.month, day.day, round(amount, 2)
+
+
+def insert_expenses(database, user_id, chunk):
+    """Insert expenses (dicts with the columns of 'expenses') in one batch
+    and update rollups and the data version. Doesn't commit."""
+
+    database.execute(
+        text(
+            """
+            INSERT INTO expenses (user_id, year, month, day, category_id, expense)
+            VALUES (:user_id, :year, :month, :day, :category_id, :expense)
+            """
+        ),
+        chunk
+    )
+
+    # One rollup update per day and category of the chunk, in one batch
+    sums = defaultdict(lambda: [0, 0.0])
+    for row in chunk:
+        key = (row['year'], row['month'], row['day'], row['category_id'])
+        sums[key][0] += 1
+        sums[key][1] += row['expense']
+    add_to_rollups(database, [
+        {
+            'user_id': user_id,
+            'year': year,
+            'month': month,
+            'day': day,
+            'category_id': category_id,
+            'count': count,
+            'amount': round(total, 2),
+        }
+        for (year, month, day, category_id), (count, total) in sums.items()
+    ])
+    bump_data_version(database, user_id)
+
+
+def category_ids(database, user_id):
+    """Return ids of categories of the user by lowercase name."""
+
+    return {
+        category.lower(): category_id
+        for category_id, category in database.execute(
+            text("SELECT id, category FROM categories WHERE user_id = :user_id"),
+            {'user_id': user_id}
+        )
+    }
+
+
+def import_chunks(user_id, rows, categories, insert, chunk_size=CHUNK_SIZE):
+    """Pass expenses of the user from (line, date, category, amount) rows
+    to insert(), which inserts and commits a chunk of them.
+
+    'categories' are the ids of categories by lowercase name (see
+    category_ids()). Invalid rows are skipped and counted. An error of
+    the file itself (e.g. a CSV header without the columns) stops the
+    import, chunks inserted before are reported. Return ImportResult.
+    """
+
+    start = time.perf_counter()
+
+    imported = 0
+    rejected = 0
+    errors = []
+    chunk = []
+    rows = iter(rows)
+    while True:
+        try:
+            row = next(rows)
+        except StopIteration:
+            break
+        except (ValueError, csv.Error) as error:
+            errors.append(str(error))
+            break
+
+        try:
+            if isinstance(row, Unreadable):
+                line_num = row.line
+                raise ValueError(row.error)
+            line_num, date, category, amount = row
+            if any(
+                REPLACEMENT_CHARACTER in (value or '')
+                for value in (date, category, amount)
+            ):
+                raise ValueError('not UTF-8 text')
+            category_id = categories.get((category or '').strip().lower())
+            if category_id is None:
+                raise ValueError(f'unknown category {category!r}')
+            year, month, day, expense = _parse(date or '', amount or '')
+        except ValueError as error:
+            rejected += 1
+            if len(errors) < MAX_ERRORS:
+                errors.append(f'Line {line_num}: {error}')
+            continue
+
+        chunk.append({
+            'user_id': user_id,
+            'year': year,
+            'month': month,
+            'day': day,
+            'category_id': category_id,
+            'expense': expense,
+        })
+        if len(chunk) >= chunk_size:
+            insert(chunk)
+            imported += len(chunk)
+            chunk = []
+
+    if chunk:
+        insert(chunk)
+        imported += len(chunk)
+
+    return ImportResult(imported, rejected, errors, time.perf_counter() - start)
+
+
+def import_expenses(database, user_id, rows, chunk_size=CHUNK_SIZE):
+    """Insert expenses of the user from (line, date, category, amount) rows.
+
+    'database' is a session or a connection, committed after every chunk.
+    Invalid rows are skipped and counted. Return ImportResult.
+    """
+
+    def insert(chunk):
+        insert_expenses(database, user_id, chunk)
+        database.commit()
+
+    return import_chunks(
+        user_id, rows, category_ids(database, user_id), insert, chunk_size
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('file')
+    parser.add_argument('--user-id', type=int, required=True)
+    parser.add_argument(
+        '--format', choices=['csv', 'ofx'],
+        help='file format (guessed from the extension by default)',
+    )
+    parser.add_argument('--category', help='category of OFX transactions')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument(
+        '--database-uri',
+        help='SQLAlchemy database URI (defaults to Config)',
+    )
+    args = parser.parse_args(argv)
+
+    file_format = args.format
+    if file_format is None:
+        file_format = 'ofx' if args.file.lower().endswith(('.ofx', '.qfx')) else 'csv'
+    if file_format == 'ofx' and not args.category:
+        parser.error('--category is required for OFX files')
+
+    if args.database_uri:
+        uri = args.database_uri
+    else:
+        from config import Config
+        uri = Config.SQLALCHEMY_DATABASE_URI
+    engine = create_engine(uri)
+
+    with open(args.file, newline='', encoding='utf-8-sig',
+              errors='replace') as stream, engine.connect() as conn:
+        if file_format == 'ofx':
+            rows = read_ofx(stream, args.category)
+        else:
+            rows = read_csv(stream)
+        result = import_expenses(conn, args.user_id, rows, args.chunk_size)
+
+    for error in result.errors:
+        print(error)
+    rate = result.imported / result.seconds if result.seconds else 0
+    print(f'Imported {result.imported} expenses, rejected {result.rejected} '
+          f'in {result.seconds:.1f} s ({rate:.0f} rows/s).')
+
+
+if __name__ == '__main__':
+    main()
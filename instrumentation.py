@@ -0,0 +1,150 @@
+"""Per-route timings of requests, reported at '/metrics'.
+
+For every request, the wall time is split into time spent in the
+database (and the number of SQL statements), rendering templates and
+rendering charts. Timings are summed per route and requests slower than
+SLOW_REQUEST_SECONDS are logged with their breakdown. Measuring costs
+a few clock reads per statement, so it is always on.
+"""
+
+import contextlib
+import contextvars
+import time
+
+from flask import before_render_template, request, template_rendered
+from sqlalchemy import event
+
+from metrics import Summary
+
+# Timings of the current request (None outside of requests)
+_timings = contextvars.ContextVar('request_timings', default=None)
+
+request_seconds = Summary(
+    'request_seconds', 'Wall time of requests, by route.', labels=('route',)
+)
+request_db_seconds = Summary(
+    'request_db_seconds',
+    'Time spent executing SQL statements in requests, by route.',
+    labels=('route',),
+)
+request_sql_statements = Summary(
+    'request_sql_statements',
+    'Number of SQL statements executed by requests, by route.',
+    labels=('route',),
+)
+request_template_seconds = Summary(
+    'request_template_seconds',
+    'Time spent rendering templates in requests, by route.',
+    labels=('route',),
+)
+request_chart_seconds = Summary(
+    'request_chart_seconds',
+    'Time spent getting charts (rendered or cached) in requests, by route.',
+    labels=('route',),
+)
+
+
+class Timings:
+    """Time spent by one request, in seconds."""
+
+    __slots__ = (
+        'start', 'db', 'statements', 'template', 'chart', '_template_start'
+    )
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.db = 0.0
+        self.statements = 0
+        self.template = 0.0
+        self.chart = 0.0
+        self._template_start = None
+
+
+# The start time is kept on the execution context, which is dropped with
+# the statement, also when it fails (after_cursor_execute doesn't fire)
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if _timings.get() is not None and context is not None:
+        context.query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    timings = _timings.get()
+    start = getattr(context, 'query_start', None)
+    if timings is not None and start is not None:
+        timings.db += time.perf_counter() - start
+        timings.statements += 1
+
+
+def _before_render(sender, template, context, **extra):
+    timings = _timings.get()
+    if timings is not None:
+        timings._template_start = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+    timings = _timings.get()
+    if timings is not None and timings._template_start is not None:
+        timings.template += time.perf_counter() - timings._template_start
+        timings._template_start = None
+
+
+@contextlib.contextmanager
+def chart_timer():
+    """Add time spent in the block to the chart time of the request."""
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _timings.get()
+        if timings is not None:
+            timings.chart += time.perf_counter() - start
+
+
+def instrument_engine(engine):
+    """Add time of statements of the engine to the current request."""
+
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def instrument_app(app, engines, slow_seconds=0):
+    """Measure requests of the application and statements of the engines.
+
+    Requests taking 'slow_seconds' or more are logged (0 disables it).
+    """
+
+    for engine in engines:
+        instrument_engine(engine)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+    @app.before_request
+    def start_timings():
+        _timings.set(Timings())
+
+    # Runs after the response is sent (also when streamed)
+    @app.teardown_request
+    def finish_timings(error=None):
+        timings = _timings.get()
+        if timings is None:
+            return
+        _timings.set(None)
+
+        route = request.endpoint or 'unknown'
+        elapsed = time.perf_counter() - timings.start
+        request_seconds.observe(elapsed, route=route)
+        request_db_seconds.observe(timings.db, route=route)
+        request_sql_statements.observe(timings.statements, route=route)
+        request_template_seconds.observe(timings.template, route=route)
+        request_chart_seconds.observe(timings.chart, route=route)
+
+        if slow_seconds and elapsed >= slow_seconds:
+            app.logger.warning(
+                'Slow request %s %s: %.3f s (db %.3f s in %d statements, '
+                'templates %.3f s, charts %.3f s)',
+                request.method, request.path, elapsed, timings.db,
+                timings.statements, timings.template, timings.chart,
+            )
@@ -0,0 +1,114 @@
+"""Application metrics exposed in the Prometheus text format.
+
+Metrics are kept per process, in memory. Every metric is registered
+when created and rendered by 'exposition()' (served at '/metrics').
+"""
+
+import threading
+
+_registry = []
+_lock = threading.Lock()
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+class Metric:
+    """Base class of metrics with optional labels."""
+
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        # Function returning the value, or dict of values by label values
+        self.function = function
+        self._values = {}
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def samples(self):
+        """Return list of (suffix, label values, value)."""
+
+        if self.function is not None:
+            values = self.function()
+            if isinstance(values, dict):
+                return [('', key, value) for key, value in values.items()]
+            return [('', (), values)]
+        with _lock:
+            return [('', key, value) for key, value in self._values.items()]
+
+    def exposition(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.type}',
+        ]
+        for suffix, key, value in self.samples():
+            lines.append(
+                f'{self.name}{suffix}{_format_labels(self.labels, key)} {value}'
+            )
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """Value which only goes up."""
+
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """Value which goes up and down, set directly or read from a function."""
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with _lock:
+            self._values[self._key(labels)] = value
+
+
+class Summary(Metric):
+    """Count and sum of observations (e.g. durations in seconds)."""
+
+    type = 'summary'
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            count, total = self._values.get(key, (0, 0.0))
+            self._values[key] = (count + 1, total + value)
+
+    def samples(self):
+        with _lock:
+            items = list(self._values.items())
+        samples = []
+        for key, (count, total) in items:
+            samples.append(('_count', key, count))
+            samples.append(('_sum', key, total))
+        return samples
+
+
+def exposition():
+    """Return all registered metrics in the Prometheus text format."""
+
+    with _lock:
+        metrics = list(_registry)
+    return '\n'.join(metric.exposition() for metric in metrics) + '\n'
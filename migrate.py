@@ -0,0 +1,205 @@
+"""Versioned schema migrations for the budget database.
+
+Each migration is applied once and recorded in the 'schema_migrations'
+table. Migrations work on both MySQL (production) and SQLite (cs50 variant).
+
+Usage:
+    python migrate.py                       # apply pending migrations
+    python migrate.py --list                # show migration status
+    python migrate.py --database-uri sqlite:///cs50/budget.db
+"""
+
+import argparse
+import datetime
+
+from sqlalchemy import create_engine, inspect, text
+
+import rollups
+
+
+def _text_column(conn, table, column):
+    """Return column name usable in an index (MySQL needs a prefix on TEXT)."""
+
+    if conn.dialect.name != 'mysql':
+        return column
+    for col in inspect(conn).get_columns(table):
+        if col['name'] == column and col['type'].__class__.__name__ in (
+            'TEXT', 'MEDIUMTEXT', 'LONGTEXT', 'TINYTEXT'
+        ):
+            # 191 characters * 4 bytes (utf8mb4) fit into the 767 bytes limit
+            return f'{column}(191)'
+    return column
+
+
+def composite_indexes(conn):
+    """Index the filters used by index(), structure() and delete_expense()."""
+
+    conn.execute(text(
+        """
+        CREATE INDEX ix_expenses_user_date_category
+            ON expenses (user_id, year, month, day, category_id)
+        """
+    ))
+    conn.execute(text(
+        f"""
+        CREATE UNIQUE INDEX ux_categories_user_category
+            ON categories (user_id, {_text_column(conn, 'categories', 'category')})
+        """
+    ))
+
+
+def expense_rollups(conn):
+    """Create and fill the table of pre-summed expenses per day."""
+
+    conn.execute(text(
+        """
+        CREATE TABLE expense_rollups (
+            user_id INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            category_id INTEGER NOT NULL,
+            expense_count INTEGER NOT NULL,
+            total DECIMAL(14, 2) NOT NULL,
+            PRIMARY KEY (user_id, year, month, day, category_id)
+        )
+        """
+    ))
+    rollups.rebuild(conn)
+
+
+def unique_usernames(conn):
+    """Let the database reject duplicate usernames (and find them fast)."""
+
+    conn.execute(text(
+        f"""
+        CREATE UNIQUE INDEX ux_users_username
+            ON users ({_text_column(conn, 'users', 'username')})
+        """
+    ))
+
+
+def data_versions(conn):
+    """Track version and time of the last change of data of every user."""
+
+    conn.execute(text(
+        "ALTER TABLE users ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"
+    ))
+    conn.execute(text(
+        "ALTER TABLE users ADD COLUMN data_modified INTEGER NOT NULL DEFAULT 0"
+    ))
+
+
+def month_totals_index(conn):
+    """Let '/analytics' sum rollups per month from the index alone."""
+
+    conn.execute(text(
+        """
+        CREATE INDEX ix_expense_rollups_month_totals
+            ON expense_rollups (user_id, year, month, category_id, total)
+        """
+    ))
+
+
+# Ordered list of (version, description, function)
+MIGRATIONS = [
+    (1, 'Composite indexes on expenses and categories', composite_indexes),
+    (2, 'Table of pre-summed expenses per day', expense_rollups),
+    (3, 'Unique index on usernames', unique_usernames),
+    (4, 'Data versions of users', data_versions),
+    (5, 'Covering index of monthly rollup totals', month_totals_index),
+]
+
+
+def applied_versions(conn):
+    """Return set of versions already applied to the database."""
+
+    conn.execute(text(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY NOT NULL,
+            description VARCHAR(255) NOT NULL,
+            applied_at VARCHAR(32) NOT NULL
+        )
+        """
+    ))
+    rows = conn.execute(text("SELECT version FROM schema_migrations"))
+    return {row[0] for row in rows}
+
+
+def upgrade(engine, target=None):
+    """Apply pending migrations up to 'target' version (all by default).
+
+    Return list of applied versions.
+    """
+
+    applied = []
+    with engine.begin() as conn:
+        done = applied_versions(conn)
+
+    for version, description, migration in MIGRATIONS:
+        if version in done or (target is not None and version > target):
+            continue
+
+        # Each migration runs in its own transaction (MySQL commits DDL
+        # implicitly, so a failed migration may need manual cleanup there)
+        with engine.begin() as conn:
+            migration(conn)
+            conn.execute(
+                text(
+                    """
+                    INSERT INTO schema_migrations (version, description, applied_at)
+                    VALUES (:version, :description, :applied_at)
+                    """
+                ),
+                {
+                    'version': version,
+                    'description': description,
+                    'applied_at': datetime.datetime.now().isoformat(
+                        timespec='seconds'
+                    ),
+                }
+            )
+        applied.append(version)
+    return applied
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--database-uri',
+        help='SQLAlchemy database URI (defaults to Config)',
+    )
+    parser.add_argument(
+        '--target', type=int, help='migrate up to this version only'
+    )
+    parser.add_argument(
+        '--list', action='store_true', help='show status of migrations'
+    )
+    args = parser.parse_args(argv)
+
+    if args.database_uri:
+        uri = args.database_uri
+    else:
+        from config import Config
+        uri = Config.SQLALCHEMY_DATABASE_URI
+    engine = create_engine(uri)
+
+    if args.list:
+        with engine.begin() as conn:
+            done = applied_versions(conn)
+        for version, description, _ in MIGRATIONS:
+            status = 'applied' if version in done else 'pending'
+            print(f'{version:04d}  {status:8}  {description}')
+        return
+
+    applied = upgrade(engine, args.target)
+    if applied:
+        for version in applied:
+            print(f'Applied migration {version:04d}')
+    else:
+        print('Database is up to date.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,539 @@
+"""Data access shared by the application and its cs50 variant.
+
+Every query of the routes is a method of Repository, run on one
+SQLAlchemy Core engine (MySQL or SQLite). Statements are built once
+and executed with bound parameters. Writes update the rollups and the
+data version of the user in the same transaction and forget cached
+lists of the user, so both applications get the same optimisations.
+Connections are checked out through database.connect(), which measures
+the wait for the pool. Reads can use a separate engine (read-only
+connections of SQLite in production mode).
+"""
+
+import calendar
+
+from sqlalchemy import text
+
+import exporter
+import importer
+
+from cache import LRUCache
+from config import Config
+from database import connect
+from rollups import add_to_rollup
+from versions import bump_data_version, get_data_version
+
+# Lists of categories and years by (user_id, name, data version). Pages
+# with a version ETag pass the version, so another worker's write can't
+# leave them with a list older than their ETag. Other callers pass None
+# and rely on the expiry.
+values_cache = LRUCache(
+    max_entries=Config.VALUES_CACHE_ENTRIES,
+    ttl=Config.VALUES_CACHE_TTL,
+    name='values',
+)
+
+FIND_USER = text("SELECT id, username, hash FROM users WHERE username = :username")
+
+USERNAME_EXISTS = text("SELECT 1 FROM users WHERE username = :username")
+
+CREATE_USER = text("INSERT INTO users (username, hash) VALUES (:username, :hash)")
+
+CATEGORIES = text(
+    """
+    SELECT id, category
+      FROM categories
+     WHERE user_id = :user_id
+     ORDER BY category
+    """
+)
+
+CATEGORY_NAMES = text("SELECT category FROM categories WHERE user_id = :user_id")
+
+EXPENSE_YEARS = text("SELECT DISTINCT year FROM expenses WHERE user_id = :user_id")
+
+ADD_CATEGORY = text(
+    "INSERT INTO categories (category, user_id) VALUES (:category, :user_id)"
+)
+
+RENAME_CATEGORY = text(
+    """
+    UPDATE categories
+       SET category = :new_category
+     WHERE category = :old_category
+       AND user_id = :user_id
+    """
+)
+
+CATEGORY_HAS_EXPENSES = text(
+    """
+    SELECT 1
+      FROM expenses
+     WHERE user_id = :user_id
+       AND category_id IN
+           (SELECT id
+              FROM categories
+             WHERE user_id = :user_id
+               AND category = :category)
+     LIMIT 1
+    """
+)
+
+DELETE_CATEGORY = text(
+    "DELETE FROM categories WHERE category = :category AND user_id = :user_id"
+)
+
+MONTH_GRID = text(
+    """
+    SELECT category, day, MIN(expenses.id) AS expense_id,
+           SUM(expense) AS expense
+      FROM expenses
+      JOIN categories
+        ON expenses.category_id = categories.id
+       AND expenses.user_id = categories.user_id
+     WHERE expenses.user_id = :user_id
+       AND year = :year
+       AND month = :month_no
+     GROUP BY category, day
+     ORDER BY category, day
+    """
+)
+
+CATEGORY_SUMS = """
+    SELECT category, SUM(total) AS sum
+      FROM expense_rollups
+      JOIN categories
+        ON expense_rollups.category_id = categories.id
+       AND expense_rollups.user_id = categories.user_id
+     WHERE expense_rollups.user_id = :user_id
+       AND year = :year
+       {month_filter}
+     GROUP BY category
+     ORDER BY category
+"""
+YEAR_SUMS = text(CATEGORY_SUMS.format(month_filter=''))
+MONTH_SUMS = text(CATEGORY_SUMS.format(month_filter='AND month = :month_no'))
+
+# Rollups are summed per month from the covering index first, then the
+# (much fewer) sums get the names of their categories
+MONTH_TOTALS = text(
+    """
+    SELECT category, year, month, total
+      FROM (SELECT category_id, year, month, SUM(total) AS total
+              FROM expense_rollups
+             WHERE user_id = :user_id
+               AND year BETWEEN :first_year AND :last_year
+             GROUP BY year, month, category_id) AS month_totals
+      JOIN categories
+        ON month_totals.category_id = categories.id
+    """
+)
+
+EXPENSE = text(
+    """
+    SELECT year, month, day, category_id, expense
+      FROM expenses
+     WHERE id = :expense_id
+       AND user_id = :user_id
+    """
+)
+
+EXPENSE_WITH_CATEGORY = text(
+    """
+    SELECT year, month, day, category_id, category
+      FROM expenses
+      JOIN categories
+        ON expenses.category_id = categories.id
+     WHERE expenses.user_id = :user_id
+       AND expenses.id = :expense_id
+    """
+)
+
+SAME_DAY_EXPENSES = text(
+    """
+    SELECT id, expense FROM expenses
+     WHERE user_id = :user_id
+       AND year = :year
+       AND month = :month
+       AND day = :day
+       AND category_id = :category_id
+    """
+)
+
+DELETE_EXPENSE = text("DELETE FROM expenses WHERE id = :expense_id")
+
+EXPENSES_PAGE = """
+    SELECT id, year, month, day, category_id, expense
+      FROM expenses
+     WHERE user_id = :user_id
+       AND id > :after_id
+       {filters}
+     ORDER BY id
+     LIMIT :limit
+"""
+EXPENSES_PAGES = {
+    (False, False): text(EXPENSES_PAGE.format(filters='')),
+    (True, False): text(EXPENSES_PAGE.format(filters='AND year = :year')),
+    (False, True): text(EXPENSES_PAGE.format(filters='AND month = :month_no')),
+    (True, True): text(EXPENSES_PAGE.format(
+        filters='AND year = :year AND month = :month_no'
+    )),
+}
+
+
+def invalidate_values(user_id):
+    """Forget cached lists of the user after a write."""
+
+    values_cache.discard(lambda key: key[0] == user_id)
+
+
+def pivot_month(rows, year, month_no, cat_list):
+    """Return rows of MONTH_GRID as expenses per category and day, and
+    totals per category (see Repository.month_grid)."""
+
+    month_days = calendar.monthrange(year, month_no)[1]
+
+    # Every category gets a row, even without expenses in this month
+    month_expenses = {category: [None] * month_days for category in cat_list}
+    total_expenses = dict.fromkeys(cat_list)
+    for row in rows:
+        if not 1 <= row.day <= month_days:
+            continue
+        days = month_expenses.setdefault(row.category, [None] * month_days)
+        days[row.day - 1] = row
+        if total_expenses.get(row.category) is None:
+            total_expenses[row.category] = row.expense
+        else:
+            total_expenses[row.category] += row.expense
+    return month_expenses, total_expenses
+
+
+class Repository:
+    """Queries of the budget database, on a SQLAlchemy engine."""
+
+    def __init__(self, engine, read_engine=None):
+        """Writes go to 'engine', reads to 'read_engine' (by default the
+        same engine), e.g. read-only connections of SQLite in WAL mode."""
+
+        self.engine = engine
+        self.read_engine = read_engine or engine
+
+    def _cached_list(self, user_id, name, statement, version=None):
+        """Return sorted values of the first column, cached per user (and
+        per data version if given)."""
+
+        key = (user_id, name, version)
+        values = values_cache.get(key)
+        if values is None:
+            with connect(self.read_engine) as conn:
+                values = tuple(sorted(
+                    row[0] for row in conn.execute(statement, {'user_id': user_id})
+                ))
+            values_cache.set(key, values)
+        # Copy, so callers can't change the cached list
+        return list(values)
+
+    # Users
+
+    def find_user(self, username):
+        """Return (id, username, hash) of the user or None."""
+
+        with connect(self.read_engine) as conn:
+            return conn.execute(FIND_USER, {'username': username}).fetchone()
+
+    def username_exists(self, username):
+        with connect(self.read_engine) as conn:
+            return conn.execute(
+                USERNAME_EXISTS, {'username': username}
+            ).fetchone() is not None
+
+    def create_user(self, username, password_hash):
+        """Add the user. Raise IntegrityError if the username is taken."""
+
+        with connect(self.engine, begin=True) as conn:
+            conn.execute(CREATE_USER, {'username': username, 'hash': password_hash})
+
+    def data_version(self, user_id):
+        """Return version of data of the user and time of the last change."""
+
+        with connect(self.read_engine) as conn:
+            return get_data_version(conn, user_id)
+
+    # Categories
+
+    def categories(self, user_id):
+        """Return (id, category) rows of the user, sorted by name."""
+
+        with connect(self.read_engine) as conn:
+            return conn.execute(CATEGORIES, {'user_id': user_id}).fetchall()
+
+    def category_names(self, user_id, version=None):
+        """Return sorted list of names of categories of the user."""
+
+        return self._cached_list(
+            user_id, 'categories', CATEGORY_NAMES, version
+        )
+
+    def expense_years(self, user_id, version=None):
+        """Return sorted list of years with expenses of the user."""
+
+        return self._cached_list(user_id, 'years', EXPENSE_YEARS, version)
+
+    def add_category(self, user_id, name):
+        """Add the category. Raise IntegrityError if the user has it."""
+
+        with connect(self.engine, begin=True) as conn:
+            conn.execute(ADD_CATEGORY, {'category': name, 'user_id': user_id})
+            bump_data_version(conn, user_id)
+        invalidate_values(user_id)
+
+    def rename_category(self, user_id, old_name, new_name):
+        """Rename the category. Raise IntegrityError if the user has a
+        category named 'new_name'."""
+
+        with connect(self.engine, begin=True) as conn:
+            conn.execute(
+                RENAME_CATEGORY,
+                {
+                    'new_category': new_name,
+                    'old_category': old_name,
+                    'user_id': user_id,
+                }
+            )
+            bump_data_version(conn, user_id)
+        invalidate_values(user_id)
+
+    def delete_category(self, user_id, name):
+        """Delete the category if it has no expenses. Return if deleted."""
+
+        params = {'category': name, 'user_id': user_id}
+        with connect(self.engine, begin=True) as conn:
+            if conn.execute(CATEGORY_HAS_EXPENSES, params).fetchone():
+                return False
+            conn.execute(DELETE_CATEGORY, params)
+            bump_data_version(conn, user_id)
+        invalidate_values(user_id)
+        return True
+
+    # Expenses
+
+    def month_grid(self, user_id, year, month_no, cat_list):
+        """Return expenses per category and day, and totals per category.
+
+        The whole category x day grid of the selected month is fetched
+        with one grouped query and pivoted here, so the number of round
+        trips does not depend on the number of categories. Expenses of
+        a category are a list indexed by day - 1, with None on days
+        without expenses.
+        """
+
+        with connect(self.read_engine) as conn:
+            rows = conn.execute(
+                MONTH_GRID,
+                {'user_id': user_id, 'year': year, 'month_no': month_no}
+            ).fetchall()
+        return pivot_month(rows, year, month_no, cat_list)
+
+    def category_sums(self, user_id, year, month_no=None):
+        """Return dict of sums of expenses per category in the year
+        (or in one month of the year), from the rollups.
+
+        Categories without expenses are left out.
+        """
+
+        with connect(self.read_engine) as conn:
+            sums = conn.execute(
+                YEAR_SUMS if month_no is None else MONTH_SUMS,
+                {'user_id': user_id, 'year': year, 'month_no': month_no}
+            ).fetchall()
+        return {category: total for category, total in sums if total}
+
+    def month_totals(self, user_id, first_year, last_year):
+        """Return (category, year, month, total) rows of the months with
+        expenses from 'first_year' to 'last_year', from the rollups."""
+
+        with connect(self.read_engine) as conn:
+            return conn.execute(
+                MONTH_TOTALS,
+                {
+                    'user_id': user_id,
+                    'first_year': first_year,
+                    'last_year': last_year,
+                }
+            ).fetchall()
+
+    def add_expenses(self, user_id, expenses):
+        """Insert expenses (dicts with the columns of 'expenses') in one
+        transaction."""
+
+        with connect(self.engine, begin=True) as conn:
+            importer.insert_expenses(conn, user_id, expenses)
+        invalidate_values(user_id)
+
+    def import_expenses(self, user_id, rows):
+        """Import (line, date, category, amount) rows in chunks.
+
+        Return importer.ImportResult.
+        """
+
+        with connect(self.read_engine) as conn:
+            categories = importer.category_ids(conn, user_id)
+
+        # The writer (the only one in SQLite production mode) is checked
+        # out per chunk, not while the file is read and parsed
+        def insert(chunk):
+            with connect(self.engine, begin=True) as conn:
+                importer.insert_expenses(conn, user_id, chunk)
+
+        try:
+            return importer.import_chunks(user_id, rows, categories, insert)
+        finally:
+            invalidate_values(user_id)
+
+    def export_expenses(self, user_id, start=None, end=None, categories=None):
+        """Yield (date, category, amount) of expenses of the user, by date."""
+
+        return exporter.export_rows(self.read_engine, user_id, start, end, categories)
+
+    def expense_day(self, user_id, expense_id):
+        """Return expense (with category name) and all expenses of the
+        user on the same day in the same category.
+
+        Return (None, []) if the expense doesn't exist (or isn't user's).
+        """
+
+        with connect(self.read_engine) as conn:
+            expense = conn.execute(
+                EXPENSE_WITH_CATEGORY,
+                {'user_id': user_id, 'expense_id': expense_id}
+            ).fetchone()
+            if expense is None:
+                return None, []
+            same_day = conn.execute(
+                SAME_DAY_EXPENSES,
+                {
+                    'user_id': user_id,
+                    'year': expense.year,
+                    'month': expense.month,
+                    'day': expense.day,
+                    'category_id': expense.category_id,
+                }
+            ).fetchall()
+        return expense, same_day
+
+    def delete_expense(self, user_id, expense_id):
+        """Delete expense of the user and subtract it from the rollups.
+
+        Return the deleted row (None if not found).
+        """
+
+        with connect(self.engine, begin=True) as conn:
+            expense = conn.execute(
+                EXPENSE, {'expense_id': expense_id, 'user_id': user_id}
+            ).fetchone()
+
+            # Nothing to do if the expense doesn't exist (or isn't user's)
+            if expense is None:
+                return None
+
+            conn.execute(DELETE_EXPENSE, {'expense_id': expense_id})
+            add_to_rollup(
+                conn,
+                user_id,
+                expense.year,
+                expense.month,
+                expense.day,
+                expense.category_id,
+                -expense.expense,
+                count=-1,
+            )
+            bump_data_version(conn, user_id)
+        invalidate_values(user_id)
+        return expense
+
+    def expenses_page(self, user_id, after_id, limit, year=None, month_no=None):
+        """Return up to 'limit' expenses with id greater than 'after_id',
+        ordered by id, and the id to pass as 'after_id' for the next page
+        (None on the last page)."""
+
+        # Fetch one row more to know if there is a next page
+        with connect(self.read_engine) as conn:
+            rows = conn.execute(
+                EXPENSES_PAGES[year is not None, month_no is not None],
+                {
+                    'user_id': user_id,
+                    'after_id': after_id,
+                    'year': year,
+                    'month_no': month_no,
+                    'limit': limit + 1,
+                }
+            ).fetchall()
+        page = rows[:limit]
+        return page, page[-1].id if len(rows) > limit else None
+
+
+class AsyncRepository:
+    """Read queries of the dashboard pages on an async SQLAlchemy engine.
+
+    Used by the ASGI entry point (asgi.py). Statements, the cache of
+    lists and the pivot of the month grid are those of Repository.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def _cached_list(self, user_id, name, statement, version=None):
+        """Return sorted values of the first column, cached per user (and
+        per data version if given)."""
+
+        key = (user_id, name, version)
+        values = values_cache.get(key)
+        if values is None:
+            async with self.engine.connect() as conn:
+                result = await conn.execute(statement, {'user_id': user_id})
+                values = tuple(sorted(row[0] for row in result))
+            values_cache.set(key, values)
+        # Copy, so callers can't change the cached list
+        return list(values)
+
+    async def data_version(self, user_id):
+        """Return version of data of the user and time of the last change."""
+
+        async with self.engine.connect() as conn:
+            return await conn.run_sync(get_data_version, user_id)
+
+    async def category_names(self, user_id, version=None):
+        """Return sorted list of names of categories of the user."""
+
+        return await self._cached_list(
+            user_id, 'categories', CATEGORY_NAMES, version
+        )
+
+    async def expense_years(self, user_id, version=None):
+        """Return sorted list of years with expenses of the user."""
+
+        return await self._cached_list(user_id, 'years', EXPENSE_YEARS, version)
+
+    async def month_grid(self, user_id, year, month_no, cat_list):
+        """Return expenses per category and day, and totals per category
+        (see Repository.month_grid)."""
+
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                MONTH_GRID,
+                {'user_id': user_id, 'year': year, 'month_no': month_no}
+            )
+            rows = result.fetchall()
+        return pivot_month(rows, year, month_no, cat_list)
+
+    async def category_sums(self, user_id, year, month_no=None):
+        """Return dict of sums of expenses per category (see
+        Repository.category_sums)."""
+
+        async with self.engine.connect() as conn:
+            result = await conn.execute(
+                YEAR_SUMS if month_no is None else MONTH_SUMS,
+                {'user_id': user_id, 'year': year, 'month_no': month_no}
+            )
+            sums = result.fetchall()
+        return {category: total for category, total in sums if total}
@@ -0,0 +1,211 @@
+"""Pre-summed expenses kept in the 'expense_rollups' table.
+
+One row per (user_id, year, month, day, category_id) holds the number
+and the sum of expenses. Routes update it in the same transaction as
+'expenses', so read paths can aggregate a few hundred rows instead of
+years of raw entries.
+
+Usage:
+    python rollups.py check                 # compare rollups with expenses
+    python rollups.py rebuild [--user-id N] # recompute from expenses
+"""
+
+import argparse
+
+from sqlalchemy import create_engine, text
+
+# Rounding errors tolerated by the consistency check
+TOLERANCE = 0.005
+
+# Largest amount of one expense. Totals are DECIMAL(14, 2), so a day of a
+# category can still sum up a thousand of them.
+MAX_EXPENSE = 999999999.99
+
+
+def _dialect(database):
+    """Return dialect name of a connection or a session."""
+
+    if hasattr(database, 'dialect'):
+        return database.dialect.name
+    return database.get_bind().dialect.name
+
+
+def add_to_rollup(database, user_id, year, month, day, category_id,
+                  amount, count=1):
+    """Add 'amount' and 'count' of expenses to the rollup row of the day.
+
+    Use negative values to subtract removed expenses. Doesn't commit.
+    """
+
+    add_to_rollups(database, [{
+        'user_id': user_id,
+        'year': year,
+        'month': month,
+        'day': day,
+        'category_id': category_id,
+        'count': count,
+        'amount': amount,
+    }])
+
+
+def add_to_rollups(database, deltas):
+    """Apply many deltas (dicts with the key columns, 'count' and 'amount')
+    in one batch. Doesn't commit."""
+
+    if _dialect(database) == 'mysql':
+        upsert = """
+            INSERT INTO expense_rollups
+                   (user_id, year, month, day, category_id, expense_count, total)
+            VALUES (:user_id, :year, :month, :day, :category_id, :count, :amount)
+                ON DUPLICATE KEY UPDATE
+                   expense_count = expense_count + VALUES(expense_count),
+                   total = total + VALUES(total)
+        """
+    else:
+        upsert = """
+            INSERT INTO expense_rollups
+                   (user_id, year, month, day, category_id, expense_count, total)
+            VALUES (:user_id, :year, :month, :day, :category_id, :count, :amount)
+                ON CONFLICT (user_id, year, month, day, category_id) DO UPDATE
+               SET expense_count = expense_count + excluded.expense_count,
+                   total = total + excluded.total
+        """
+
+    params = [
+        {
+            'user_id': delta['user_id'],
+            'year': int(delta['year']),
+            'month': int(delta['month']),
+            'day': int(delta['day']),
+            'category_id': int(delta['category_id']),
+            'count': delta['count'],
+            'amount': delta['amount'],
+        }
+        for delta in deltas
+    ]
+    if not params:
+        return
+    database.execute(text(upsert), params)
+
+    # Drop rows once their last expense is gone
+    removed = [delta for delta in params if delta['count'] < 0]
+    if removed:
+        database.execute(
+            text(
+                """
+                DELETE FROM expense_rollups
+                 WHERE user_id = :user_id
+                   AND year = :year
+                   AND month = :month
+                   AND day = :day
+                   AND category_id = :category_id
+                   AND expense_count <= 0
+                """
+            ),
+            removed
+        )
+
+
+def rebuild(database, user_id=None):
+    """Recompute rollups from 'expenses' (of one user or all). Doesn't commit."""
+
+    where = '' if user_id is None else 'WHERE user_id = :user_id'
+    database.execute(
+        text(f"DELETE FROM expense_rollups {where}"),
+        {'user_id': user_id}
+    )
+    database.execute(
+        text(
+            f"""
+            INSERT INTO expense_rollups
+                   (user_id, year, month, day, category_id, expense_count, total)
+            SELECT user_id, year, month, day, category_id, COUNT(*), SUM(expense)
+              FROM expenses
+             {where}
+             GROUP BY user_id, year, month, day, category_id
+            """
+        ),
+        {'user_id': user_id}
+    )
+
+
+def check(database, user_id=None):
+    """Return list of (key, (count, total) in rollups, (count, total) in expenses)
+    for every day on which rollups and raw expenses disagree."""
+
+    where = '' if user_id is None else 'WHERE user_id = :user_id'
+    expected = {
+        tuple(row[:5]): (row[5], row[6])
+        for row in database.execute(
+            text(
+                f"""
+                SELECT user_id, year, month, day, category_id,
+                       COUNT(*), SUM(expense)
+                  FROM expenses
+                 {where}
+                 GROUP BY user_id, year, month, day, category_id
+                """
+            ),
+            {'user_id': user_id}
+        )
+    }
+    actual = {
+        tuple(row[:5]): (row[5], row[6])
+        for row in database.execute(
+            text(
+                f"""
+                SELECT user_id, year, month, day, category_id,
+                       expense_count, total
+                  FROM expense_rollups
+                 {where}
+                """
+            ),
+            {'user_id': user_id}
+        )
+    }
+
+    mismatches = []
+    for key in sorted(expected.keys() | actual.keys()):
+        got = actual.get(key, (0, 0))
+        want = expected.get(key, (0, 0))
+        if got[0] != want[0] or abs(float(got[1]) - float(want[1])) > TOLERANCE:
+            mismatches.append((key, got, want))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=['check', 'rebuild'])
+    parser.add_argument(
+        '--database-uri',
+        help='SQLAlchemy database URI (defaults to Config)',
+    )
+    parser.add_argument('--user-id', type=int, help='only this user')
+    args = parser.parse_args(argv)
+
+    if args.database_uri:
+        uri = args.database_uri
+    else:
+        from config import Config
+        uri = Config.SQLALCHEMY_DATABASE_URI
+    engine = create_engine(uri)
+
+    with engine.begin() as conn:
+        if args.command == 'rebuild':
+            rebuild(conn, args.user_id)
+            print('Rollups rebuilt.')
+            return
+
+        mismatches = check(conn, args.user_id)
+    for key, got, want in mismatches:
+        print(
+            'user {} {}-{:02d}-{:02d} category {}: '.format(*key)
+            + f'rollup {got[0]} / {got[1]}, expenses {want[0]} / {want[1]}'
+        )
+    print(f'{len(mismatches)} inconsistent day(s).')
+    if mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
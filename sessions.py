@@ -0,0 +1,223 @@
+"""Server-side sessions stored in SQLite or Redis.
+
+The browser only keeps a random session id in a cookie, the data is
+kept by a store shared by all workers (SQLite, on one host) or all hosts
+(Redis). Sessions are written only when they change, or when half of
+their lifetime has passed, and expire SESSION_LIFETIME seconds after
+the last write.
+"""
+
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class PickleSerializer:
+    """Serializer of session data.
+
+    Pickle keeps key types (session keys may be ints) and the data is
+    only ever written by the application itself, never by the client.
+    """
+
+    def dumps(self, data):
+        return pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+serializer = PickleSerializer()
+
+
+class SqliteSessionStore:
+    """Sessions in a SQLite database in WAL mode.
+
+    Every thread uses its own connection. Expired sessions are ignored
+    when read and deleted by sweep(), at most every 'sweep_interval'
+    seconds.
+    """
+
+    def __init__(self, path, sweep_interval=60):
+        self.path = path
+        self.sweep_interval = sweep_interval
+        self._next_sweep = 0
+        self._local = threading.local()
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id TEXT PRIMARY KEY NOT NULL,
+                    data BLOB NOT NULL,
+                    expires REAL NOT NULL
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_sessions_expires ON sessions (expires)"
+            )
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, sid):
+        """Return (data, expiry timestamp) of the session or None."""
+
+        row = self._connection().execute(
+            "SELECT data, expires FROM sessions WHERE id = ? AND expires > ?",
+            (sid, time.time())
+        ).fetchone()
+        return row
+
+    def set(self, sid, data, ttl):
+        with self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, data, expires) VALUES (?, ?, ?)",
+                (sid, data, time.time() + ttl)
+            )
+        if time.monotonic() >= self._next_sweep:
+            self.sweep()
+
+    def delete(self, sid):
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def sweep(self):
+        """Delete expired sessions."""
+
+        self._next_sweep = time.monotonic() + self.sweep_interval
+        with self._connection() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires <= ?", (time.time(),))
+
+
+class RedisSessionStore:
+    """Sessions in Redis (or any server speaking the Redis protocol).
+
+    Redis expires keys itself, so there is nothing to sweep. A client
+    with the redis-py interface can be passed instead of the url
+    (e.g. connected to a local stand-in).
+    """
+
+    prefix = 'session:'
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError(
+                    "SESSION_BACKEND 'redis' requires the redis package"
+                )
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def get(self, sid):
+        with self.client.pipeline() as pipe:
+            pipe.get(self.prefix + sid)
+            pipe.ttl(self.prefix + sid)
+            data, ttl = pipe.execute()
+        if data is None:
+            return None
+        return data, time.time() + max(ttl, 0)
+
+    def set(self, sid, data, ttl):
+        self.client.set(self.prefix + sid, data, ex=max(int(ttl), 1))
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def sweep(self):
+        pass
+
+
+class StoredSession(CallbackDict, SessionMixin):
+    """Session data loaded from a store, tracking modifications."""
+
+    def __init__(self, initial=None, sid=None, new=False, expires=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires = expires
+        self.modified = False
+
+
+class StoreSessionInterface(SessionInterface):
+    """Flask session interface keeping sessions in a store."""
+
+    def __init__(self, store, lifetime):
+        self.store = store
+        self.lifetime = lifetime
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            stored = self.store.get(sid)
+            if stored is not None:
+                data, expires = stored
+                return StoredSession(
+                    serializer.loads(data), sid=sid, expires=expires
+                )
+        return StoredSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # Empty session (e.g. after logging out) is removed
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        # Responses depend on the user
+        response.vary.add('Cookie')
+
+        # Skip the write unless data changed or the session gets old
+        refresh = (
+            session.expires is not None
+            and session.expires - time.time() < self.lifetime / 2
+        )
+        if session.modified or session.new or refresh:
+            self.store.set(
+                session.sid, serializer.dumps(dict(session)), self.lifetime
+            )
+
+        if session.new:
+            response.set_cookie(
+                name,
+                session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def make_session_interface(config):
+    """Return session interface for the SESSION_BACKEND of the config."""
+
+    backend = config['SESSION_BACKEND']
+    if backend == 'sqlite':
+        store = SqliteSessionStore(config['SESSION_SQLITE_PATH'])
+    elif backend == 'redis':
+        store = RedisSessionStore(config['SESSION_REDIS_URL'])
+    else:
+        raise ValueError(f'Unknown SESSION_BACKEND: {backend}')
+    return StoreSessionInterface(store, config['SESSION_LIFETIME'])
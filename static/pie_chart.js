@@ -0,0 +1,87 @@
+// Draw the pie chart of expenses in the browser from JSON data
+// ({"category": sum, ...}) served by '/structure/data'
+(function () {
+    'use strict';
+
+    // seaborn 'crest' palette used by the server-side chart
+    const COLORS = ['#7dba91', '#59a590', '#40908e', '#287a8c', '#1c6488', '#254b7f'];
+    const SVG_NS = 'http://www.w3.org/2000/svg';
+
+    const container = document.getElementById('pie-chart');
+
+    function element(name, attributes) {
+        const node = document.createElementNS(SVG_NS, name);
+        for (const [key, value] of Object.entries(attributes)) {
+            node.setAttribute(key, value);
+        }
+        return node;
+    }
+
+    function point(radius, angle) {
+        return [radius * Math.cos(angle), radius * Math.sin(angle)];
+    }
+
+    function draw(data) {
+        const entries = Object.entries(data).filter(([, sum]) => sum > 0);
+        const total = entries.reduce((acc, [, sum]) => acc + sum, 0);
+
+        // Same sizes as the figures rendered by Matplotlib (inches * 72 dpi)
+        const mobile = /Mobile/.test(navigator.userAgent);
+        const size = mobile ? 331 : 720;
+        const fontSize = mobile ? 12 : 16;
+        const radius = size / 2 - 10;
+
+        const svg = element('svg', {
+            width: size,
+            height: size,
+            viewBox: `${-size / 2} ${-size / 2} ${size} ${size}`,
+        });
+
+        // Start at 3 o'clock and go counterclockwise like Matplotlib
+        let angle = 0;
+        entries.forEach(([category, sum], i) => {
+            const sweep = 2 * Math.PI * sum / total;
+            const color = COLORS[i % COLORS.length];
+            const wedge = { fill: color, stroke: 'white', 'stroke-width': 2 };
+
+            if (entries.length === 1) {
+                svg.appendChild(element('circle', { r: radius, ...wedge }));
+            } else {
+                const [x1, y1] = point(radius, -angle);
+                const [x2, y2] = point(radius, -(angle + sweep));
+                const large = sweep > Math.PI ? 1 : 0;
+                svg.appendChild(element('path', {
+                    d: `M 0 0 L ${x1} ${y1} A ${radius} ${radius} 0 ${large} 0 ${x2} ${y2} Z`,
+                    ...wedge,
+                }));
+            }
+
+            // Label and percentage in the middle of the wedge
+            const [x, y] = point(radius * 0.6, -(angle + sweep / 2));
+            const label = element('text', {
+                x: x,
+                y: y - fontSize * 0.6,
+                'font-size': fontSize,
+                'text-anchor': 'middle',
+            });
+            label.textContent = category;
+            const percentage = element('text', {
+                x: x,
+                y: y + fontSize * 0.8,
+                'font-size': fontSize,
+                'text-anchor': 'middle',
+            });
+            percentage.textContent = `${(100 * sum / total).toFixed(2)}%`;
+            svg.appendChild(label);
+            svg.appendChild(percentage);
+
+            angle += sweep;
+        });
+
+        container.replaceChildren(svg);
+    }
+
+    fetch(container.dataset.url, { credentials: 'same-origin' })
+        .then((response) => response.json())
+        .then(draw);
+})();
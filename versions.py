@@ -0,0 +1,94 @@
+"""Per-user data versions used for conditional requests.
+
+Every write to the expenses or categories of a user bumps the version
+(and the time of the last change) kept in 'users', in the same
+transaction. Pages are identified by the version of the data they show,
+so a client which already has the current page gets 304 Not Modified
+without the page being queried or drawn again.
+"""
+
+import datetime
+import hashlib
+import os
+import time
+
+from sqlalchemy import text
+
+from metrics import Counter, Gauge
+
+
+def bump_data_version(database, user_id):
+    """Mark data of the user as changed. Doesn't commit."""
+
+    database.execute(
+        text(
+            """
+            UPDATE users
+               SET data_version = data_version + 1,
+                   data_modified = :now
+             WHERE id = :user_id
+            """
+        ),
+        {'user_id': user_id, 'now': int(time.time())}
+    )
+
+
+def get_data_version(database, user_id):
+    """Return version of data of the user and time of the last change
+    (None if the data never changed)."""
+
+    row = database.execute(
+        text("SELECT data_version, data_modified FROM users WHERE id = :user_id"),
+        {'user_id': user_id}
+    ).fetchone()
+    if row is None:
+        return 0, None
+    version, modified = row
+    if not modified:
+        return version, None
+    return version, datetime.datetime.fromtimestamp(
+        modified, tz=datetime.timezone.utc
+    )
+
+
+def templates_digest(directory):
+    """Return digest of the templates, so pages of a new release get
+    new ETags."""
+
+    digest = hashlib.sha1()
+    for name in sorted(os.listdir(directory)):
+        with open(os.path.join(directory, name), 'rb') as template:
+            digest.update(name.encode())
+            digest.update(template.read())
+    return digest.hexdigest()
+
+
+def page_etag(salt, *parts):
+    """Return strong ETag of a page identified by 'parts'."""
+
+    return hashlib.sha1(repr((salt,) + parts).encode()).hexdigest()
+
+
+page_responses = Counter(
+    'page_responses_total',
+    'Responses of pages with validators, by route and status (200 or 304).',
+    labels=('route', 'status'),
+)
+
+
+def _not_modified_ratio():
+    ratios = {}
+    for route in {route for route, _ in list(page_responses._values)}:
+        not_modified = page_responses.value(route=route, status='304')
+        total = not_modified + page_responses.value(route=route, status='200')
+        if total:
+            ratios[(route,)] = not_modified / total
+    return ratios
+
+
+page_not_modified_ratio = Gauge(
+    'page_not_modified_ratio',
+    'Fraction of responses of pages served as 304 Not Modified, by route.',
+    labels=('route',),
+    function=_not_modified_ratio,
+)